@@ -0,0 +1,517 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
+from pathlib import Path
+from sampler import iterate_raw_records
+from writers_config import files_and_parsers, setup_writers
+
+
+class WorkQueue:
+    """
+    Work units are claimed under a lease. A unit whose lease expires (crashed worker)
+    or that fails is handed out again until max_attempts is reached.
+    """
+
+    def __init__(self, lease_seconds=600, max_attempts=3) -> None:
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def add_units(self, units):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def claim(self, worker_id):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def renew(self, unit_id, worker_id):
+        """Extends the lease, returns False once worker_id no longer holds it."""
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def complete(self, unit_id, worker_id):
+        """Marks the unit done, returns False if worker_id no longer holds it."""
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def fail(self, unit_id, worker_id, error):
+        """Re-queues or fails the unit, only while worker_id still holds it."""
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def counts(self):
+        raise NotImplementedError("Subclasses should implement this method")
+
+    def is_finished(self):
+        counts = self.counts()
+        return counts.get("pending", 0) == 0 and counts.get("running", 0) == 0
+
+
+class SQLiteWorkQueue(WorkQueue):
+    def __init__(self, db_path, lease_seconds=600, max_attempts=3) -> None:
+        super().__init__(lease_seconds, max_attempts)
+        self.db_path = db_path
+        self.con = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS units (
+                id TEXT PRIMARY KEY,
+                unit TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                lease_until REAL,
+                error TEXT
+            )
+            """)
+
+    def add_units(self, units):
+        with self.con:
+            self.con.executemany(
+                "INSERT OR IGNORE INTO units (id, unit) VALUES (?, ?)",
+                [(unit["id"], json.dumps(unit)) for unit in units],
+            )
+
+    def claim(self, worker_id):
+        now = time.time()
+        self.con.execute("BEGIN IMMEDIATE")
+        try:
+            # Expired leases on their last attempt are failed rather than re-queued.
+            self.con.execute(
+                """
+                UPDATE units SET status = 'failed', error = 'lease expired'
+                WHERE status = 'running' AND lease_until < ? AND attempts >= ?
+                """,
+                (now, self.max_attempts),
+            )
+            row = self.con.execute(
+                """
+                SELECT id, unit FROM units
+                WHERE status = 'pending' OR (status = 'running' AND lease_until < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                self.con.execute("COMMIT")
+                return None
+            self.con.execute(
+                """
+                UPDATE units SET status = 'running', attempts = attempts + 1,
+                worker = ?, lease_until = ? WHERE id = ?
+                """,
+                (worker_id, now + self.lease_seconds, row[0]),
+            )
+            self.con.execute("COMMIT")
+        except Exception:
+            self.con.execute("ROLLBACK")
+            raise
+        return json.loads(row[1])
+
+    def renew(self, unit_id, worker_id):
+        with self.con:
+            cursor = self.con.execute(
+                """
+                UPDATE units SET lease_until = ?
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (time.time() + self.lease_seconds, unit_id, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def complete(self, unit_id, worker_id):
+        with self.con:
+            cursor = self.con.execute(
+                """
+                UPDATE units SET status = 'done', lease_until = NULL
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (unit_id, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, unit_id, worker_id, error):
+        with self.con:
+            cursor = self.con.execute(
+                """
+                UPDATE units SET lease_until = NULL, error = ?,
+                status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                WHERE id = ? AND worker = ? AND status = 'running'
+                """,
+                (error, self.max_attempts, unit_id, worker_id),
+            )
+        return cursor.rowcount > 0
+
+    def counts(self):
+        rows = self.con.execute("SELECT status, COUNT(*) FROM units GROUP BY status")
+        return dict(rows.fetchall())
+
+
+class FileLeaseWorkQueue(WorkQueue):
+    """
+    Queue kept as plain files so it works on any shared filesystem.
+    Leases are created with link(), which never replaces an existing lease. The
+    owner renews by replacing its lease in place. Breaking or dropping a lease
+    first renames it to a private path and checks expiry or owner there.
+    """
+
+    def __init__(self, directory, lease_seconds=600, max_attempts=3) -> None:
+        super().__init__(lease_seconds, max_attempts)
+        self.directory = Path(directory)
+        for sub_dir in ["units", "leases", "attempts", "done", "failed"]:
+            os.makedirs(self.directory / sub_dir, exist_ok=True)
+
+    def path(self, sub_dir, unit_id):
+        return self.directory / sub_dir / unit_id
+
+    def add_units(self, units):
+        for unit in units:
+            unit_path = self.path("units", f"{unit['id']}.json")
+            if not unit_path.exists():
+                tmp_path = unit_path.with_suffix(f".tmp-{uuid.uuid4().hex}")
+                tmp_path.write_text(json.dumps(unit))
+                os.replace(tmp_path, unit_path)
+
+    def unit_ids(self):
+        return sorted(p.stem for p in (self.directory / "units").glob("*.json"))
+
+    def attempts(self, unit_id):
+        attempts_path = self.path("attempts", unit_id)
+        return int(attempts_path.read_text()) if attempts_path.exists() else 0
+
+    def new_lease(self, unit_id, worker_id, lease_path=None):
+        lease_path = lease_path or self.path(
+            "leases", f"{unit_id}.new-{uuid.uuid4().hex}"
+        )
+        lease = {"worker": worker_id, "expires": time.time() + self.lease_seconds}
+        lease_path.write_text(json.dumps(lease))
+        return lease_path
+
+    def take_lease(self, unit_id):
+        """Moves the lease to a private path, so nobody else can act on it meanwhile."""
+        held_path = self.path("leases", f"{unit_id}.held-{uuid.uuid4().hex}")
+        try:
+            os.rename(self.path("leases", unit_id), held_path)
+        except FileNotFoundError:
+            return None, None
+        return held_path, json.loads(held_path.read_text())
+
+    def put_lease(self, unit_id, held_path):
+        # link() fails instead of replacing a lease another worker created meanwhile.
+        try:
+            os.link(held_path, self.path("leases", unit_id))
+            return True
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(held_path)
+
+    def break_expired_lease(self, unit_id):
+        try:
+            lease = json.loads(self.path("leases", unit_id).read_text())
+        except FileNotFoundError:
+            return
+        if lease["expires"] > time.time():
+            return
+        held_path, lease = self.take_lease(unit_id)
+        if held_path is None:
+            return
+        # Checked again on the file actually taken, which may be a fresh lease
+        # created after the first read. That one is put back.
+        if lease["expires"] > time.time():
+            self.put_lease(unit_id, held_path)
+        else:
+            os.remove(held_path)
+
+    def claim(self, worker_id):
+        for unit_id in self.unit_ids():
+            if (
+                self.path("done", unit_id).exists()
+                or self.path("failed", unit_id).exists()
+            ):
+                continue
+            self.break_expired_lease(unit_id)
+            # Leases are written privately and linked in, so they never appear half written.
+            if not self.put_lease(unit_id, self.new_lease(unit_id, worker_id)):
+                continue
+            if self.path("done", unit_id).exists():
+                # Completed by its previous owner between the check above and the link.
+                self.drop_lease(unit_id, worker_id)
+                continue
+            attempts = self.attempts(unit_id)
+            if attempts >= self.max_attempts:
+                self.path("failed", unit_id).write_text("max attempts reached")
+                os.remove(self.path("leases", unit_id))
+                continue
+            self.path("attempts", unit_id).write_text(str(attempts + 1))
+            return json.loads(self.path("units", f"{unit_id}.json").read_text())
+        return None
+
+    def owns_lease(self, unit_id, worker_id):
+        try:
+            lease = json.loads(self.path("leases", unit_id).read_text())
+        except FileNotFoundError:
+            return False
+        return lease["worker"] == worker_id
+
+    def drop_lease(self, unit_id, worker_id):
+        held_path, lease = self.take_lease(unit_id)
+        if held_path is None:
+            return
+        if lease["worker"] == worker_id:
+            os.remove(held_path)
+        else:
+            self.put_lease(unit_id, held_path)
+
+    def renew(self, unit_id, worker_id):
+        # The lease file is replaced in place and never removed, so the unit never
+        # looks unleased to other workers. Renewals every lease/3 keep it well
+        # clear of the expiry that lets another worker break it.
+        if not self.owns_lease(unit_id, worker_id):
+            return False
+        os.replace(self.new_lease(unit_id, worker_id), self.path("leases", unit_id))
+        return True
+
+    def complete(self, unit_id, worker_id):
+        if not self.owns_lease(unit_id, worker_id):
+            return False
+        self.path("done", unit_id).touch()
+        self.drop_lease(unit_id, worker_id)
+        return True
+
+    def fail(self, unit_id, worker_id, error):
+        if not self.owns_lease(unit_id, worker_id):
+            return False
+        if self.attempts(unit_id) >= self.max_attempts:
+            self.path("failed", unit_id).write_text(error)
+        self.drop_lease(unit_id, worker_id)
+        return True
+
+    def counts(self):
+        counts = {}
+        for unit_id in self.unit_ids():
+            if self.path("done", unit_id).exists():
+                status = "done"
+            elif self.path("failed", unit_id).exists():
+                status = "failed"
+            elif self.path("leases", unit_id).exists():
+                status = "running"
+            else:
+                status = "pending"
+            counts[status] = counts.get(status, 0) + 1
+        return counts
+
+
+def get_queue(queue_url, lease_seconds=600, max_attempts=3):
+    if queue_url.startswith("sqlite://"):
+        return SQLiteWorkQueue(
+            queue_url[len("sqlite://") :], lease_seconds, max_attempts
+        )
+    if queue_url.startswith("file://"):
+        return FileLeaseWorkQueue(
+            queue_url[len("file://") :], lease_seconds, max_attempts
+        )
+    raise ValueError(f"Unknown queue backend: {queue_url} (use sqlite:// or file://)")
+
+
+def write_shards(category, file_path, tag, shard_path, unit_size):
+    """
+    Splits a dump into one small gzip file per work unit during the coordinator's
+    single pass, so each worker decompresses only its own records instead of the
+    dump prefix up to its range.
+    """
+    units = []
+    shard = None
+    for i, raw in enumerate(iterate_raw_records(file_path, tag)):
+        if i % unit_size == 0:
+            if shard is not None:
+                shard.write(f"</{tag}s>".encode())
+                shard.close()
+            unit_id = f"{category}-{i // unit_size:05d}"
+            unit_file = shard_path / f"{unit_id}.xml.gz"
+            shard = gzip.open(unit_file, "wb", compresslevel=1)
+            shard.write(f'<?xml version="1.0" encoding="UTF-8"?><{tag}s>'.encode())
+            units.append(
+                {
+                    "id": unit_id,
+                    "category": category,
+                    "file_path": str(unit_file),
+                    "start": i,
+                    "end": i + unit_size,
+                }
+            )
+        shard.write(raw)
+        shard.write(b"\n")
+    if shard is not None:
+        shard.write(f"</{tag}s>".encode())
+        shard.close()
+    return units
+
+
+def plan_units(raw_data_path, unit_size, shard_path):
+    os.makedirs(shard_path, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=len(files_and_parsers)) as executor:
+        futures = [
+            executor.submit(
+                write_shards,
+                category,
+                raw_data_path / file_name,
+                parser.tag,
+                shard_path,
+                unit_size,
+            )
+            for category, (file_name, parser) in files_and_parsers.items()
+        ]
+    return [unit for future in futures for unit in future.result()]
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def process_unit(unit, output_path, lease_lost=None):
+    parser = files_and_parsers[unit["category"]][1](file_path=unit["file_path"])
+    part_path = output_path / "parts" / unit["id"]
+    # Written outside parts/ so loaders never see a partial unit.
+    tmp_path = output_path / "parts.tmp" / f"{unit['id']}-{uuid.uuid4().hex}"
+    os.makedirs(tmp_path)
+    try:
+        writers = [
+            writer
+            for writer_name, writer in setup_writers(csv_path=tmp_path).items()
+            if writer_name.split("_")[0] == unit["category"]
+        ]
+        for writer in writers:
+            writer.open_file()
+        for row in parser.parse_file():
+            if lease_lost is not None and lease_lost.is_set():
+                raise LeaseLost(unit["id"])
+            for writer in writers:
+                writer.write_record(row)
+        for writer in writers:
+            writer.close_file()
+        if lease_lost is not None and lease_lost.is_set():
+            raise LeaseLost(unit["id"])
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    # Outputs only become visible once the whole unit is written.
+    shutil.rmtree(part_path, ignore_errors=True)
+    os.rename(tmp_path, part_path)
+
+
+def heartbeat(queue_url, unit_id, worker_id, stop, lost, lease_seconds, max_attempts):
+    # Own connection (sqlite connections are per thread) with the worker's lease length.
+    queue = get_queue(queue_url, lease_seconds, max_attempts)
+    while not stop.wait(lease_seconds / 3):
+        if not queue.renew(unit_id, worker_id):
+            lost.set()
+            return
+
+
+def run_worker(queue_url, output_path, lease_seconds, max_attempts, poll_interval=10):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    queue = get_queue(queue_url, lease_seconds, max_attempts)
+    while True:
+        unit = queue.claim(worker_id)
+        if unit is None:
+            if queue.is_finished():
+                break
+            time.sleep(poll_interval)
+            continue
+        stop = threading.Event()
+        lost = threading.Event()
+        renewer = threading.Thread(
+            target=heartbeat,
+            args=(
+                queue_url,
+                unit["id"],
+                worker_id,
+                stop,
+                lost,
+                lease_seconds,
+                max_attempts,
+            ),
+            daemon=True,
+        )
+        renewer.start()
+        start_time = time.time()
+        try:
+            process_unit(unit, output_path, lost)
+            if not queue.complete(unit["id"], worker_id):
+                raise LeaseLost(unit["id"])
+            duration = (time.time() - start_time) / 60
+            print(f"{worker_id}: {unit['id']} completed in {duration:.2f} minutes.")
+        except LeaseLost:
+            # Another worker holds the unit now, its attempt and outcome are its own.
+            print(f"{worker_id}: lease on {unit['id']} lost, left to its new owner")
+        except Exception as exc:
+            queue.fail(unit["id"], worker_id, repr(exc))
+            print(f"{worker_id}: error processing {unit['id']}: {exc}")
+        finally:
+            stop.set()
+            renewer.join()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Discogs Ingest (distributed)")
+    parser.add_argument("role", choices=["coordinator", "worker", "status"])
+    parser.add_argument(
+        "--queue",
+        help="Queue backend, sqlite:///path/queue.db or file:///shared/queue_dir",
+        required=True,
+    )
+    parser.add_argument("--dir", help="Enter directory to save partitioned files to.")
+    parser.add_argument("--raw_dir", help="Enter directory of raw data dumps")
+    parser.add_argument(
+        "--unit_size", type=int, default=250_000, help="Records per work unit"
+    )
+    parser.add_argument(
+        "--shard_dir",
+        help="Shared directory for the per unit dump shards (default: <raw_dir>/shards)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Worker processes to start on this host"
+    )
+    parser.add_argument("--lease_seconds", type=int, default=600)
+    parser.add_argument("--max_attempts", type=int, default=3)
+    return parser.parse_args()
+
+
+def main():
+    base_path = Path(os.path.abspath("")).parent
+    args = get_args()
+
+    if args.role == "coordinator":
+        raw_data_path = (
+            base_path / args.raw_dir if args.raw_dir else base_path / "raw_data"
+        )
+        shard_path = (
+            base_path / args.shard_dir if args.shard_dir else raw_data_path / "shards"
+        )
+        units = plan_units(raw_data_path, args.unit_size, shard_path)
+        get_queue(args.queue).add_units(units)
+        print(f"Queued {len(units)} work units")
+    elif args.role == "worker":
+        output_path = base_path / args.dir
+        os.makedirs(output_path / "parts", exist_ok=True)
+        workers = [
+            Process(
+                target=run_worker,
+                args=(args.queue, output_path, args.lease_seconds, args.max_attempts),
+            )
+            for _ in range(args.workers)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    print(get_queue(args.queue).counts())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import json
+import os
+from array import array
+from bisect import bisect_left
+
+import duckdb
+
+
+def to_int(value):
+    return int(value) if value and value.isdigit() else None
+
+
+class SortedIdMap:
+    """
+    Compact id -> value map: ids in a sorted int64 array, looked up by bisection.
+    Dumps are mostly in id order, so ids are only re-sorted if needed.
+    """
+
+    def __init__(self) -> None:
+        self.ids = array("q")
+        self.is_sorted = True
+
+    def add_id(self, entity_id):
+        if self.ids and entity_id < self.ids[-1]:
+            self.is_sorted = False
+        self.ids.append(entity_id)
+
+    def finalize(self):
+        if not self.is_sorted:
+            order = sorted(range(len(self.ids)), key=self.ids.__getitem__)
+            self.reorder(order)
+            self.is_sorted = True
+        return self
+
+    def reorder(self, order):
+        self.ids = array("q", (self.ids[i] for i in order))
+
+    def index(self, entity_id):
+        if entity_id is None:
+            return None
+        i = bisect_left(self.ids, entity_id)
+        if i < len(self.ids) and self.ids[i] == entity_id:
+            return i
+        return None
+
+
+class IdNameMap(SortedIdMap):
+    """Names are stored back to back in one utf-8 buffer with an offsets array."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.offsets = array("Q", [0])
+        self.names = bytearray()
+
+    def add(self, entity_id, name):
+        self.add_id(entity_id)
+        self.names += (name or "").encode()
+        self.offsets.append(len(self.names))
+
+    def reorder(self, order):
+        names, offsets = bytearray(), array("Q", [0])
+        for i in order:
+            names += self.names[self.offsets[i] : self.offsets[i + 1]]
+            offsets.append(len(names))
+        self.names, self.offsets = names, offsets
+        super().reorder(order)
+
+    def get(self, entity_id):
+        i = self.index(entity_id)
+        if i is None:
+            return None
+        return self.names[self.offsets[i] : self.offsets[i + 1]].decode()
+
+
+class IdYearMap(SortedIdMap):
+    def __init__(self) -> None:
+        super().__init__()
+        self.years = array("H")
+
+    def add(self, entity_id, year):
+        self.add_id(entity_id)
+        self.years.append(year or 0)
+
+    def reorder(self, order):
+        self.years = array("H", (self.years[i] for i in order))
+        super().reorder(order)
+
+    def get(self, entity_id):
+        i = self.index(entity_id)
+        if i is None or not self.years[i]:
+            return None
+        return self.years[i]
+
+
+def read_csv_columns(csv_file, id_column, value_column, batch_size=100_000):
+    """(id, value) rows of a CSV written earlier in the run, in id order."""
+    con = duckdb.connect()
+    result = con.execute(
+        f"""SELECT TRY_CAST({id_column} AS BIGINT) AS id, {value_column}
+        FROM read_csv('{csv_file}', header=true, all_varchar=true)
+        WHERE TRY_CAST({id_column} AS BIGINT) IS NOT NULL
+        ORDER BY id"""
+    )
+    while rows := result.fetchmany(batch_size):
+        yield from rows
+    con.close()
+
+
+def load_artist_names(artist_csv):
+    artist_names = IdNameMap()
+    for artist_id, name in read_csv_columns(artist_csv, "id", "artist"):
+        artist_names.add(artist_id, name)
+    return artist_names.finalize()
+
+
+def load_master_years(master_csv):
+    master_years = IdYearMap()
+    for master_id, year in read_csv_columns(master_csv, "id", "year"):
+        master_years.add(master_id, to_int(year))
+    return master_years.finalize()
+
+
+def build_artist_names(artist_parser):
+    artist_names = IdNameMap()
+    for row in artist_parser.parse_file():
+        artist_id = to_int(row.get("id"))
+        if artist_id is not None:
+            artist_names.add(artist_id, row.get("artist"))
+    return artist_names.finalize()
+
+
+def build_master_years(master_parser):
+    master_years = IdYearMap()
+    for row in master_parser.parse_file():
+        master_id = to_int(row.get("id"))
+        if master_id is not None:
+            master_years.add(master_id, to_int(row.get("year")))
+    return master_years.finalize()
+
+
+document_columns = {
+    "id": "BIGINT",
+    "title": "VARCHAR",
+    "country": "VARCHAR",
+    "release_date": "VARCHAR",
+    "notes": "VARCHAR",
+    "master_id": "BIGINT",
+    "master_year": "USMALLINT",
+    "is_master_release": "BOOLEAN",
+    "artists": "STRUCT(id BIGINT, name VARCHAR, credited_name VARCHAR)[]",
+    "extra_artists": (
+        "STRUCT(id BIGINT, name VARCHAR, credited_name VARCHAR, role VARCHAR)[]"
+    ),
+    "label": "STRUCT(id BIGINT, name VARCHAR, catno VARCHAR)",
+    "format": "STRUCT(name VARCHAR, description VARCHAR, quantity VARCHAR)",
+    "genres": "VARCHAR[]",
+    "styles": "VARCHAR[]",
+    "tracks": "STRUCT(position VARCHAR, title VARCHAR, duration VARCHAR)[]",
+    "videos": "STRUCT(url VARCHAR, duration VARCHAR)[]",
+    "companies": "STRUCT(id BIGINT, name VARCHAR, role VARCHAR)[]",
+}
+
+
+class ReleaseDocumentWriter:
+    """
+    Writes one nested document per release with canonical artist names and the
+    master year resolved from the artist and master dumps, as JSON lines or Parquet.
+    Names and years are read from artist_csv/master_csv when this run writes them,
+    so the job must run after those writers; otherwise the dump is parsed again.
+    """
+
+    def __init__(
+        self,
+        file_name=None,
+        artist_parser=None,
+        master_parser=None,
+        output_format="jsonl",
+        artist_csv=None,
+        master_csv=None,
+    ) -> None:
+        self.file_name = file_name
+        self.artist_parser = artist_parser
+        self.master_parser = master_parser
+        self.artist_csv = artist_csv
+        self.master_csv = master_csv
+        self.output_format = output_format
+        self.jsonl_path = f"{file_name}.jsonl"
+        self.file = None
+        self.artist_names = None
+        self.master_years = None
+
+    def open_file(self):
+        if self.artist_names is None:
+            self.artist_names = (
+                load_artist_names(self.artist_csv)
+                if self.artist_csv
+                else build_artist_names(self.artist_parser)
+            )
+            self.master_years = (
+                load_master_years(self.master_csv)
+                if self.master_csv
+                else build_master_years(self.master_parser)
+            )
+        if not self.file:
+            self.file = open(self.jsonl_path, "w")
+
+    def write_rows(self, rows):
+        self.open_file()
+        for row in rows:
+            self.write_record(row)
+        self.close_file()
+
+    def write_record(self, row):
+        self.file.write(json.dumps(self.build_document(row), ensure_ascii=False))
+        self.file.write("\n")
+
+    def resolve_artist(self, artist_id, name, anv):
+        # <name> is the canonical name as of the release, <anv> how it was credited.
+        artist_id = to_int(artist_id)
+        return {
+            "id": artist_id,
+            "name": self.artist_names.get(artist_id) or name,
+            "credited_name": anv or name,
+        }
+
+    def build_document(self, row):
+        master_id = to_int(row.get("master_id"))
+        return {
+            "id": to_int(row.get("id")),
+            "title": row.get("title"),
+            "country": row.get("country"),
+            "release_date": row.get("release_date"),
+            "notes": row.get("notes"),
+            "master_id": master_id,
+            "master_year": self.master_years.get(master_id),
+            "is_master_release": row.get("is_master_release") == "true",
+            "artists": [
+                self.resolve_artist(artist_id, name, anv)
+                for artist_id, name, anv, _ in row.get("artist_credits", [])
+            ],
+            "extra_artists": [
+                {**self.resolve_artist(artist_id, name, anv), "role": role}
+                for artist_id, name, anv, role in row.get("extra_artist_credits", [])
+            ],
+            "label": {
+                "id": to_int(row.get("label_id")),
+                "name": row.get("label_name"),
+                "catno": row.get("catno"),
+            },
+            "format": {
+                "name": row.get("format"),
+                "description": row.get("format_description"),
+                "quantity": row.get("quantity"),
+            },
+            "genres": row.get("genre", []),
+            "styles": row.get("style", []),
+            "tracks": [
+                {"position": position, "title": title, "duration": duration}
+                for position, title, duration in zip(
+                    row.get("track_position", []),
+                    row.get("track_title", []),
+                    row.get("track_duration", []),
+                )
+            ],
+            "videos": [
+                {"url": url, "duration": duration}
+                for url, duration in zip(row.get("urls", []), row.get("duration", []))
+            ],
+            "companies": [
+                {"id": to_int(company_id), "name": name, "role": role}
+                for company_id, name, role in zip(
+                    row.get("company_id", []),
+                    row.get("company_names", []),
+                    row.get("company_roles", []),
+                )
+            ],
+        }
+
+    def close_file(self):
+        if not self.file:
+            return
+        self.file.close()
+        self.file = None
+        if self.output_format == "parquet":
+            # An explicit schema, inference from a sample of the documents can
+            # mistype a nested field that is empty or null early in the file.
+            columns = ", ".join(
+                f"'{column}': '{column_type}'"
+                for column, column_type in document_columns.items()
+            )
+            con = duckdb.connect()
+            con.execute(
+                f"COPY (SELECT * FROM read_json('{self.jsonl_path}', "
+                f"format='newline_delimited', columns={{{columns}}})) "
+                f"TO '{self.file_name}.parquet' (FORMAT PARQUET)"
+            )
+            con.close()
+            os.remove(self.jsonl_path)
@@ -6,13 +6,82 @@ from tqdm import tqdm
 def get_args():
     parser = argparse.ArgumentParser(description="Discogs Ingest")
     parser.add_argument("--db", required=True)
-    parser.add_argument("--csvs", required=True)
+    parser.add_argument("--csvs", help="Load these CSV outputs into the database")
+    parser.add_argument(
+        "--partitioned",
+        action="store_true",
+        help="Load the parts/<unit>/ outputs written by distributed.py workers",
+    )
+    parser.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Cluster tables on their keys and refresh the aggregate tables",
+    )
 
     args = parser.parse_args()
+    if not args.csvs and not args.optimize:
+        parser.error("one of --csvs or --optimize is required")
     return args
 
 
-def create_tables(db_path, csv_path):
+# Table -> key its rows are sorted on, so row group min/max zone maps prune lookups.
+cluster_keys = {
+    "artist": "id",
+    "artist_alias": "artist_id",
+    "artist_name_variation": "artist_id",
+    "artist_url": "artist_id",
+    "label": "id",
+    "label_url": "label_id",
+    "sub_label": "parent_label_id",
+    "master": "id",
+    "master_artist": "master_id",
+    "master_genre": "master_id",
+    "master_style": "master_id",
+    "master_video": "master_id",
+    "release": "id",
+    "release_artist": "release_id",
+    "release_company": "release_id",
+    "release_extra_artist": "release_id",
+    "release_genre": "release_id",
+    "release_style": "release_id",
+    "release_track": "release_id",
+    "release_video": "release_id",
+}
+
+# Aggregate -> (group columns, contribution query). Every contribution row is one
+# release counted towards one group, keyed by release_id.
+aggregate_specs = {
+    "artist_release_count": (
+        ["artist_id"],
+        "SELECT DISTINCT release_id, artist_id FROM release_artist "
+        "WHERE artist_id IS NOT NULL",
+    ),
+    "label_release_count": (
+        ["label_id"],
+        "SELECT DISTINCT id AS release_id, label_id FROM release "
+        "WHERE label_id IS NOT NULL",
+    ),
+    "year_release_count": (
+        ["year"],
+        "SELECT DISTINCT id AS release_id, year FROM ("
+        "SELECT id, TRY_CAST(left(CAST(release_date AS VARCHAR), 4) AS INTEGER) AS year "
+        "FROM release) WHERE year > 0",
+    ),
+    "genre_style_count": (
+        ["genre", "style"],
+        "SELECT DISTINCT g.release_id, g.genre, s.style "
+        "FROM release_genre g JOIN release_style s USING (release_id) "
+        "WHERE g.genre IS NOT NULL AND s.style IS NOT NULL",
+    ),
+    "master_release_count": (
+        ["master_id"],
+        "SELECT DISTINCT id AS release_id, master_id FROM release "
+        "WHERE master_id IS NOT NULL",
+    ),
+}
+
+
+def create_tables(db_path, csv_path, partitioned=False):
     con = duckdb.connect(f"{db_path}/discogs.db")
     tables_and_files = {
         "artist_alias": "artist_alias.csv",
@@ -37,7 +106,12 @@ def create_tables(db_path, csv_path):
         "sub_label": "sub_label.csv",
     }
     for table_name, file_name in tqdm(tables_and_files.items()):
-        full_file_path = f"{csv_path}/{file_name}"
+        # Only published <category>-<index> unit directories, never leftovers.
+        full_file_path = (
+            f"{csv_path}/parts/[a-z]*-[0-9]*/{file_name}"
+            if partitioned
+            else f"{csv_path}/{file_name}"
+        )
         drop_query = f"DROP TABLE IF EXISTS {table_name}"
         con.execute(drop_query)
         query = f"CREATE TABLE {table_name} AS SELECT * FROM read_csv_auto('{full_file_path}')"
@@ -45,10 +119,59 @@ def create_tables(db_path, csv_path):
         print(f"Table {table_name} created from {file_name}")
 
 
+def table_exists(con, table_name):
+    query = "SELECT count(*) FROM information_schema.tables WHERE table_name = ?"
+    return con.execute(query, [table_name]).fetchone()[0] > 0
+
+
+def cluster_tables(db_path):
+    """
+    Rewrites each table sorted on its key. Ties keep their load order (rowid), so
+    track order within a release is unchanged.
+    """
+    con = duckdb.connect(f"{db_path}/discogs.db")
+    for table_name, key in tqdm(cluster_keys.items()):
+        if not table_exists(con, table_name):
+            continue
+        con.execute(
+            f"CREATE OR REPLACE TABLE {table_name} AS "
+            f"SELECT * FROM {table_name} ORDER BY {key}, rowid"
+        )
+        print(f"Table {table_name} clustered on {key}")
+    con.close()
+
+
+def refresh_aggregate(con, name, group_columns, contribution_query):
+    """
+    Recomputes {name} (group columns -> release_count) from its contribution
+    query. Tables are reloaded whole from the CSVs, so there is no change set to
+    apply and a full GROUP BY is the cheapest correct refresh.
+    """
+    columns = ", ".join(group_columns)
+    con.execute(
+        f"CREATE OR REPLACE TABLE {name} AS "
+        f"SELECT {columns}, count(*) AS release_count "
+        f"FROM ({contribution_query}) GROUP BY {columns} ORDER BY {columns}"
+    )
+    return con.execute(f"SELECT count(*) FROM {name}").fetchone()[0]
+
+
+def refresh_aggregates(db_path):
+    con = duckdb.connect(f"{db_path}/discogs.db")
+    for name, (group_columns, contribution_query) in aggregate_specs.items():
+        groups = refresh_aggregate(con, name, group_columns, contribution_query)
+        print(f"Aggregate {name} refreshed, {groups} groups")
+    con.close()
+
+
 def main():
     args = get_args()
 
-    create_tables(args.db, args.csvs)
+    if args.csvs:
+        create_tables(args.db, args.csvs, args.partitioned)
+    if args.optimize:
+        cluster_tables(args.db)
+        refresh_aggregates(args.db)
 
 
 if __name__ == "__main__":
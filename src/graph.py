@@ -0,0 +1,306 @@
+import argparse
+import csv
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import deque
+from pathlib import Path
+
+node_types = ["artist", "release", "label"]
+# Edge type -> (csv file, source column, source type, target column, target type)
+edge_sources = {
+    "alias": ("artist_alias.csv", "artist_id", "artist", "alias_id", "artist"),
+    "release_artist": (
+        "release_artist.csv",
+        "release_id",
+        "release",
+        "artist_id",
+        "artist",
+    ),
+    "extra_artist": (
+        "release_extra_artist.csv",
+        "release_id",
+        "release",
+        "artist_id",
+        "artist",
+    ),
+    "release_label": ("release.csv", "id", "release", "label_id", "label"),
+}
+node_sources = {
+    "artist": ("artist.csv", "id"),
+    "release": ("release.csv", "id"),
+    "label": ("label.csv", "id"),
+}
+
+
+def read_columns(file_path, columns):
+    if not os.path.isfile(file_path):
+        print(f"Skipping missing file {file_path}")
+        return
+    with open(file_path, newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        indexes = [header.index(column) for column in columns]
+        for row in reader:
+            values = [row[i] for i in indexes]
+            if all(value.isdigit() for value in values):
+                yield [int(value) for value in values]
+
+
+def write_array(directory, name, values):
+    with open(directory / f"{name}.bin", "wb") as f:
+        values.tofile(f)
+
+
+class GraphBuilder:
+    """
+    Builds compressed sparse row adjacency arrays from the ingest CSV outputs.
+    Every edge is stored in both directions. Node rows are grouped by node type,
+    and each type has a dense id -> row array for constant-time remapping.
+    """
+
+    def __init__(self, csv_path, graph_path) -> None:
+        self.csv_path = Path(csv_path)
+        self.graph_path = Path(graph_path)
+
+    def collect_ids(self):
+        ids = {node_type: set() for node_type in node_types}
+        for node_type, (file_name, column) in node_sources.items():
+            for (node_id,) in read_columns(self.csv_path / file_name, [column]):
+                ids[node_type].add(node_id)
+        for file_name, src_col, src_type, dst_col, dst_type in edge_sources.values():
+            for src, dst in read_columns(self.csv_path / file_name, [src_col, dst_col]):
+                ids[src_type].add(src)
+                ids[dst_type].add(dst)
+        return {
+            node_type: array("q", sorted(values)) for node_type, values in ids.items()
+        }
+
+    def build(self):
+        os.makedirs(self.graph_path, exist_ok=True)
+        ids = self.collect_ids()
+        offsets, rows = {}, {}
+        n_nodes = 0
+        for node_type in node_types:
+            offsets[node_type] = n_nodes
+            node_ids = ids[node_type]
+            id_rows = array("i", [-1]) * ((node_ids[-1] + 1) if node_ids else 0)
+            for row, node_id in enumerate(node_ids):
+                id_rows[node_id] = row
+            rows[node_type] = id_rows
+            n_nodes += len(node_ids)
+            write_array(self.graph_path, f"{node_type}_ids", node_ids)
+            write_array(self.graph_path, f"{node_type}_rows", id_rows)
+
+        sources, targets, types = array("I"), array("I"), array("B")
+        edge_codes = {edge_type: code for code, edge_type in enumerate(edge_sources)}
+        for edge_type, (
+            file_name,
+            src_col,
+            src_type,
+            dst_col,
+            dst_type,
+        ) in edge_sources.items():
+            src_rows, dst_rows = rows[src_type], rows[dst_type]
+            src_offset, dst_offset = offsets[src_type], offsets[dst_type]
+            for src, dst in read_columns(self.csv_path / file_name, [src_col, dst_col]):
+                sources.append(src_offset + src_rows[src])
+                targets.append(dst_offset + dst_rows[dst])
+                types.append(edge_codes[edge_type])
+
+        degrees = array("Q", [0]) * (n_nodes + 1)
+        for src, dst in zip(sources, targets):
+            degrees[src + 1] += 1
+            degrees[dst + 1] += 1
+        for row in range(n_nodes):
+            degrees[row + 1] += degrees[row]
+        indptr = degrees
+        cursor = array("Q", indptr[:-1])
+        indices = array("I", [0]) * (2 * len(sources))
+        edge_types = array("B", [0]) * (2 * len(sources))
+        for src, dst, edge_type in zip(sources, targets, types):
+            for a, b in ((src, dst), (dst, src)):
+                position = cursor[a]
+                indices[position] = b
+                edge_types[position] = edge_type
+                cursor[a] = position + 1
+
+        write_array(self.graph_path, "indptr", indptr)
+        write_array(self.graph_path, "indices", indices)
+        write_array(self.graph_path, "edge_types", edge_types)
+        meta = {
+            "byteorder": sys.byteorder,
+            "n_nodes": n_nodes,
+            "n_edges": len(indices),
+            "node_types": {
+                node_type: {"offset": offsets[node_type], "count": len(ids[node_type])}
+                for node_type in node_types
+            },
+            "edge_types": edge_codes,
+            "dtypes": {
+                "indptr": "u8",
+                "indices": "u4",
+                "edge_types": "u1",
+                "<type>_ids": "i8",
+                "<type>_rows": "i4",
+            },
+        }
+        with open(self.graph_path / "meta.json", "w") as f:
+            json.dump(meta, f, indent=2)
+        return meta
+
+
+class Graph:
+    """
+    Traversal over the memory mapped CSR arrays written by GraphBuilder.
+    Nodes are addressed as (node_type, discogs_id).
+    """
+
+    def __init__(self, graph_path) -> None:
+        self.graph_path = Path(graph_path)
+        with open(self.graph_path / "meta.json") as f:
+            self.meta = json.load(f)
+        self.edge_codes = self.meta["edge_types"]
+        self.edge_names = {code: name for name, code in self.edge_codes.items()}
+        self.indptr = self.map_array("indptr", "Q")
+        self.indices = self.map_array("indices", "I")
+        self.edge_types = self.map_array("edge_types", "B")
+        self.ids = {t: self.map_array(f"{t}_ids", "q") for t in node_types}
+        self.rows = {t: self.map_array(f"{t}_rows", "i") for t in node_types}
+        self.type_bounds = sorted(
+            (info["offset"], node_type)
+            for node_type, info in self.meta["node_types"].items()
+        )
+
+    def map_array(self, name, typecode):
+        with open(self.graph_path / f"{name}.bin", "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(typecode)
+
+    def row(self, node_type, node_id):
+        id_rows = self.rows[node_type]
+        if node_id < 0 or node_id >= len(id_rows) or id_rows[node_id] < 0:
+            raise KeyError(f"{node_type} {node_id} is not in the graph")
+        return self.meta["node_types"][node_type]["offset"] + id_rows[node_id]
+
+    def node(self, row):
+        for offset, node_type in reversed(self.type_bounds):
+            if row >= offset:
+                return node_type, self.ids[node_type][row - offset]
+
+    def edge_filter(self, edge_types):
+        if edge_types is None:
+            return None
+        return {self.edge_codes[edge_type] for edge_type in edge_types}
+
+    def neighbor_rows(self, row, codes=None):
+        start, end = self.indptr[row], self.indptr[row + 1]
+        if codes is None:
+            return self.indices[start:end].tolist()
+        edge_types = self.edge_types[start:end]
+        return [
+            neighbor
+            for neighbor, code in zip(self.indices[start:end], edge_types)
+            if code in codes
+        ]
+
+    def neighbors(self, node_type, node_id, edge_types=None):
+        row = self.row(node_type, node_id)
+        start, end = self.indptr[row], self.indptr[row + 1]
+        codes = self.edge_filter(edge_types)
+        return [
+            (*self.node(neighbor), self.edge_names[code])
+            for neighbor, code in zip(
+                self.indices[start:end], self.edge_types[start:end]
+            )
+            if codes is None or code in codes
+        ]
+
+    def k_hop(self, node_type, node_id, k=None, edge_types=None):
+        """Nodes within k hops (unbounded if k is None) mapped to their distance."""
+        codes = self.edge_filter(edge_types)
+        start = self.row(node_type, node_id)
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            row = queue.popleft()
+            if k is not None and distances[row] >= k:
+                continue
+            for neighbor in self.neighbor_rows(row, codes):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[row] + 1
+                    queue.append(neighbor)
+        return {self.node(row): distance for row, distance in distances.items()}
+
+    def traverse(self, node_type, node_id, path):
+        """
+        Follows one edge type per step, e.g. ["release_artist", "release_label"]
+        gives the labels an artist's releases appear on.
+        """
+        frontier = {self.row(node_type, node_id)}
+        for edge_type in path:
+            codes = self.edge_filter([edge_type])
+            frontier = {
+                neighbor
+                for row in frontier
+                for neighbor in self.neighbor_rows(row, codes)
+            }
+        return sorted(self.node(row) for row in frontier)
+
+    def component(self, node_type, node_id, edge_types=None):
+        """
+        Nodes connected to one node. The traversal is pure Python and costs time
+        proportional to the component, so there is no whole-graph labelling.
+        """
+        return sorted(self.k_hop(node_type, node_id, edge_types=edge_types))
+
+
+def parse_node(value):
+    node_type, node_id = value.split(":")
+    return node_type, int(node_id)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Discogs relationship graph")
+    parser.add_argument("--graph", help="Graph directory", required=True)
+    parser.add_argument("--csvs", help="Build the graph from these CSV outputs")
+    parser.add_argument("--neighbors", type=parse_node, help="e.g. artist:1")
+    parser.add_argument("--k_hop", type=parse_node, help="e.g. artist:1")
+    parser.add_argument("--k", type=int, default=2)
+    parser.add_argument(
+        "--path", nargs="+", help="Edge types to follow from --k_hop's node instead"
+    )
+    parser.add_argument("--component", type=parse_node, help="e.g. artist:1")
+    parser.add_argument("--edge_types", nargs="+", choices=list(edge_sources))
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    if args.csvs:
+        meta = GraphBuilder(args.csvs, args.graph).build()
+        print(f"Graph with {meta['n_nodes']} nodes and {meta['n_edges']} edges written")
+    graph = Graph(args.graph)
+    if args.neighbors:
+        for neighbor in graph.neighbors(*args.neighbors, edge_types=args.edge_types):
+            print(*neighbor)
+    if args.k_hop and args.path:
+        for neighbor in graph.traverse(*args.k_hop, args.path):
+            print(*neighbor)
+    elif args.k_hop:
+        hops = graph.k_hop(*args.k_hop, k=args.k, edge_types=args.edge_types)
+        for (node_type, node_id), distance in sorted(hops.items(), key=lambda x: x[1]):
+            print(distance, node_type, node_id)
+    if args.component:
+        nodes = graph.component(*args.component, edge_types=args.edge_types)
+        for node in nodes:
+            print(*node)
+        print(f"{len(nodes)} nodes in the component")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import argparse
+import json
+import os
+import re
+import shutil
+from datetime import date
+from hashlib import blake2b
+from pathlib import Path
+
+import duckdb
+
+from writers_config import files_and_parsers
+
+entity_types = list(files_and_parsers)
+partition_columns = {
+    "versions": {
+        "id": "BIGINT",
+        "content_hash": "VARCHAR",
+        "record": "VARCHAR",
+        "bucket": "BIGINT",
+        "valid_from": "DATE",
+    },
+    "closed": {
+        "id": "BIGINT",
+        "valid_from": "DATE",
+        "deleted": "BOOLEAN",
+        "bucket": "BIGINT",
+        "valid_to": "DATE",
+    },
+}
+
+
+def dump_files(raw_data_path, dump_date=None):
+    """Dump file per entity type, for the dump date in files_and_parsers by default."""
+    files = {}
+    for entity_type, (file_name, parser) in files_and_parsers.items():
+        if dump_date:
+            file_name = re.sub(r"discogs_\d{8}_", f"discogs_{dump_date}_", file_name)
+        files[entity_type] = (Path(raw_data_path) / file_name, parser)
+    return files
+
+
+def dump_date_of(file_path):
+    match = re.search(r"discogs_(\d{4})(\d{2})(\d{2})_", Path(file_path).name)
+    if match is None:
+        raise ValueError(f"No dump date in file name {file_path}")
+    return date(*map(int, match.groups())).isoformat()
+
+
+def content_hash(serialized):
+    return blake2b(serialized.encode(), digest_size=16).hexdigest()
+
+
+class HistoryStore:
+    """
+    Versioned entity records across monthly dumps, stored once per change.
+
+    <entity>/versions/bucket=B/valid_from=D   records that are new or changed in dump D
+    <entity>/closed/bucket=B/valid_to=D       (id, valid_from) of versions ended by dump D
+    <entity>/state_D.parquet                  id -> content hash as of dump D, for the next diff
+
+    Both partition sets are append only, so a dump adds files proportional to
+    what changed. bucket = id % buckets lets single entity history reads prune
+    to one bucket, and the date partitions let as-of reads skip later dumps.
+    A dump is committed by meta.json, which names the state the next load diffs
+    against, so an interrupted load leaves the last committed dump intact.
+    """
+
+    def __init__(self, history_path, buckets=16) -> None:
+        self.history_path = Path(history_path)
+        os.makedirs(self.history_path, exist_ok=True)
+        self.meta_path = self.history_path / "meta.json"
+        if self.meta_path.exists():
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"buckets": buckets, "dumps": {}}
+        self.buckets = self.meta["buckets"]
+
+    def save_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f, indent=2)
+        os.replace(tmp_path, self.meta_path)
+
+    def entity_path(self, entity_type):
+        return self.history_path / entity_type
+
+    def state_path(self, entity_type, dump_date):
+        return self.entity_path(entity_type) / f"state_{dump_date}.parquet"
+
+    def remove_old_states(self, entity_type, dump_date):
+        keep = self.state_path(entity_type, dump_date)
+        for path in self.entity_path(entity_type).glob("state_*.parquet"):
+            if path != keep:
+                os.remove(path)
+
+    def read_partitions(self, entity_type, kind, where):
+        """Subquery over one partition set, filters on bucket and dates prune files."""
+        path = self.entity_path(entity_type) / kind
+        if not any(path.glob("*/*/*.parquet")):
+            columns = ", ".join(
+                f"NULL::{column_type} AS {column}"
+                for column, column_type in partition_columns[kind].items()
+            )
+            return f"(SELECT {columns} WHERE false)"
+        return (
+            f"(SELECT * FROM read_parquet('{path}/*/*/*.parquet', hive_partitioning=1) "
+            f"WHERE {where})"
+        )
+
+    def stage_snapshot(self, parser, snapshot_path):
+        with open(snapshot_path, "w") as f:
+            for record in parser.parse_file():
+                if not record or not str(record.get("id", "")).isdigit():
+                    continue
+                serialized = json.dumps(record, sort_keys=True, ensure_ascii=False)
+                f.write(
+                    json.dumps(
+                        {
+                            "id": int(record["id"]),
+                            "content_hash": content_hash(serialized),
+                            "record": serialized,
+                        },
+                        ensure_ascii=False,
+                    )
+                )
+                f.write("\n")
+
+    def remove_partial(self, entity_type, dump_date):
+        # Leftovers of an interrupted load of this dump, which never reached meta.json.
+        for kind, column in [("versions", "valid_from"), ("closed", "valid_to")]:
+            for partition in (self.entity_path(entity_type) / kind).glob(
+                f"*/{column}={dump_date}"
+            ):
+                shutil.rmtree(partition)
+
+    def load_dump(self, entity_type, parser, dump_date):
+        loaded = self.meta["dumps"].setdefault(entity_type, [])
+        if loaded and dump_date <= loaded[-1]:
+            raise ValueError(
+                f"{entity_type} dump {dump_date} is not newer than {loaded[-1]}"
+            )
+        entity_path = self.entity_path(entity_type)
+        os.makedirs(entity_path, exist_ok=True)
+        self.remove_partial(entity_type, dump_date)
+        snapshot_path = entity_path / "snapshot.tmp.jsonl"
+        state_path = self.state_path(entity_type, loaded[-1]) if loaded else None
+        self.stage_snapshot(parser, snapshot_path)
+
+        con = duckdb.connect()
+        con.execute(
+            f"""CREATE TEMP TABLE snapshot AS
+            SELECT DISTINCT ON (id) * FROM read_json('{snapshot_path}',
+                format='newline_delimited',
+                columns={{'id': 'BIGINT', 'content_hash': 'VARCHAR', 'record': 'VARCHAR'}})"""
+        )
+        if state_path:
+            con.execute(
+                f"CREATE TEMP TABLE state AS SELECT * FROM read_parquet('{state_path}')"
+            )
+        else:
+            con.execute(
+                "CREATE TEMP TABLE state (id BIGINT, content_hash VARCHAR, valid_from DATE)"
+            )
+        valid_date = f"DATE '{dump_date}'"
+        partition_options = (
+            "FORMAT PARQUET, OVERWRITE_OR_IGNORE, FILENAME_PATTERN 'data_{i}'"
+        )
+        con.execute(f"""CREATE TEMP TABLE changed AS
+            SELECT s.id, s.id % {self.buckets} AS bucket, {valid_date} AS valid_from,
+                s.content_hash, s.record
+            FROM snapshot s LEFT JOIN state c USING (id)
+            WHERE c.id IS NULL OR c.content_hash <> s.content_hash
+            ORDER BY s.id""")
+        con.execute(f"""CREATE TEMP TABLE closed AS
+            SELECT c.id, c.id % {self.buckets} AS bucket, c.valid_from,
+                {valid_date} AS valid_to, s.id IS NULL AS deleted
+            FROM state c LEFT JOIN snapshot s USING (id)
+            WHERE s.id IS NULL OR s.content_hash <> c.content_hash
+            ORDER BY c.id""")
+        for table, directory, partitions in [
+            ("changed", "versions", "bucket, valid_from"),
+            ("closed", "closed", "bucket, valid_to"),
+        ]:
+            con.execute(
+                f"COPY {table} TO '{entity_path}/{directory}' "
+                f"({partition_options}, PARTITION_BY ({partitions}))"
+            )
+        con.execute(f"""COPY (
+                SELECT s.id, s.content_hash,
+                    CASE WHEN c.content_hash = s.content_hash
+                        THEN c.valid_from ELSE {valid_date} END AS valid_from
+                FROM snapshot s LEFT JOIN state c USING (id)
+                ORDER BY s.id
+            ) TO '{self.state_path(entity_type, dump_date)}' (FORMAT PARQUET)""")
+        total, changed, closed = con.execute(
+            "SELECT (SELECT count(*) FROM snapshot), (SELECT count(*) FROM changed), "
+            "(SELECT count(*) FROM closed)"
+        ).fetchone()
+        con.close()
+        os.remove(snapshot_path)
+        loaded.append(dump_date)
+        self.save_meta()
+        self.remove_old_states(entity_type, dump_date)
+        return {"records": total, "new_versions": changed, "closed_versions": closed}
+
+    def id_filter(self, ids):
+        if ids is None:
+            return "true"
+        ids = [int(entity_id) for entity_id in ids]
+        buckets = sorted({entity_id % self.buckets for entity_id in ids})
+        return (
+            f"bucket IN ({', '.join(map(str, buckets))}) "
+            f"AND id IN ({', '.join(map(str, ids))})"
+        )
+
+    def query(self, sql):
+        con = duckdb.connect()
+        result = con.execute(sql)
+        columns = [column[0] for column in result.description]
+        rows = [dict(zip(columns, row)) for row in result.fetchall()]
+        con.close()
+        for row in rows:
+            row["record"] = json.loads(row["record"])
+        return rows
+
+    def as_of(self, entity_type, dump_date, ids=None):
+        """Records as they were in dump_date, optionally only the given ids."""
+        ids_where = self.id_filter(ids)
+        versions = self.read_partitions(
+            entity_type, "versions", f"valid_from <= DATE '{dump_date}' AND {ids_where}"
+        )
+        closed = self.read_partitions(
+            entity_type, "closed", f"valid_to <= DATE '{dump_date}' AND {ids_where}"
+        )
+        return self.query(f"""SELECT v.id, v.valid_from, v.record FROM {versions} v
+            ANTI JOIN {closed} c ON c.id = v.id AND c.valid_from = v.valid_from
+            ORDER BY v.id""")
+
+    def history(self, entity_type, entity_id):
+        """Every stored version of one entity with its valid_from/valid_to dump dates."""
+        ids_where = self.id_filter([entity_id])
+        versions = self.read_partitions(entity_type, "versions", ids_where)
+        closed = self.read_partitions(entity_type, "closed", ids_where)
+        return self.query(f"""SELECT v.id, v.valid_from, c.valid_to,
+                coalesce(c.deleted, false) AS deleted, v.content_hash, v.record
+            FROM {versions} v
+            LEFT JOIN {closed} c ON c.id = v.id AND c.valid_from = v.valid_from
+            ORDER BY v.valid_from""")
+
+    def summary(self):
+        lines = []
+        for entity_type, dumps in self.meta["dumps"].items():
+            versions_path = self.entity_path(entity_type) / "versions"
+            size = sum(f.stat().st_size for f in versions_path.rglob("*.parquet"))
+            lines.append(
+                f"{entity_type}: {len(dumps)} dumps ({', '.join(dumps)}), "
+                f"{size / 2**20:.1f} MB of versions"
+            )
+        return lines
+
+
+def parse_entity(value):
+    entity_type, entity_id = value.split(":")
+    return entity_type, int(entity_id)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Discogs history store")
+    parser.add_argument("--history", help="History store directory", required=True)
+    parser.add_argument("--raw_dir", help="Load the dumps in this directory")
+    parser.add_argument(
+        "--dump_date", help="Dump date in the file names, e.g. 20240801 (optional)"
+    )
+    parser.add_argument(
+        "--types", nargs="+", choices=entity_types, default=entity_types
+    )
+    parser.add_argument("--buckets", type=int, default=16)
+    parser.add_argument(
+        "--as_of", help="Print records as of this date, e.g. 2024-08-01"
+    )
+    parser.add_argument(
+        "--ids", nargs="+", type=int, help="Restrict --as_of to these ids"
+    )
+    parser.add_argument("--entity_history", type=parse_entity, help="e.g. release:1")
+    return parser.parse_args()
+
+
+def main():
+    base_path = Path(os.path.abspath("")).parent
+    args = get_args()
+    store = HistoryStore(base_path / args.history, args.buckets)
+
+    if args.raw_dir:
+        for entity_type, (file_path, parser) in dump_files(
+            base_path / args.raw_dir, args.dump_date
+        ).items():
+            if entity_type not in args.types:
+                continue
+            result = store.load_dump(
+                entity_type, parser(file_path=file_path), dump_date_of(file_path)
+            )
+            print(
+                f"{entity_type}: {result['records']} records, "
+                f"{result['new_versions']} new versions, "
+                f"{result['closed_versions']} closed"
+            )
+    if args.as_of:
+        for entity_type in args.types:
+            for row in store.as_of(entity_type, args.as_of, args.ids):
+                print(json.dumps({"type": entity_type, **row}, default=str))
+    if args.entity_history:
+        for row in store.history(*args.entity_history):
+            print(json.dumps(row, default=str))
+    for line in store.summary():
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
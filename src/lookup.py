@@ -0,0 +1,320 @@
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from urllib.parse import parse_qs, urlparse
+
+import duckdb
+
+# Entity -> (base table, child aggregates). Each child aggregate is
+# (output column, source, foreign key, aggregate expression, default when no rows).
+entity_specs = {
+    "release": (
+        "release",
+        [
+            (
+                "artists",
+                "release_artist ra LEFT JOIN artist a ON a.id = ra.artist_id",
+                "ra.release_id",
+                "list({'id': ra.artist_id, 'name': a.artist})",
+                "[]",
+            ),
+            (
+                "extra_artists",
+                "release_extra_artist ea",
+                "ea.release_id",
+                "list({'id': ea.artist_id, 'role': ea.role})",
+                "[]",
+            ),
+            (
+                "tracks",
+                "release_track t",
+                "t.release_id",
+                "list({'position': t.position, 'title': t.title, "
+                "'duration': t.duration} ORDER BY t.rowid)",
+                "[]",
+            ),
+            ("genres", "release_genre g", "g.release_id", "list(g.genre)", "[]"),
+            ("styles", "release_style s", "s.release_id", "list(s.style)", "[]"),
+        ],
+    ),
+    "artist": (
+        "artist",
+        [
+            (
+                "aliases",
+                "artist_alias al",
+                "al.artist_id",
+                "list({'id': al.alias_id, 'name': al.alias})",
+                "[]",
+            ),
+            (
+                "name_variations",
+                "artist_name_variation n",
+                "n.artist_id",
+                "list(n.name_var)",
+                "[]",
+            ),
+            ("urls", "artist_url u", "u.artist_id", "list(u.url)", "[]"),
+        ],
+    ),
+    "master": (
+        "master",
+        [
+            (
+                "artists",
+                "master_artist ma LEFT JOIN artist a ON a.id = ma.artist_id",
+                "ma.master_id",
+                "list({'id': ma.artist_id, 'name': a.artist})",
+                "[]",
+            ),
+            ("genres", "master_genre g", "g.master_id", "list(g.genre)", "[]"),
+            ("styles", "master_style s", "s.master_id", "list(s.style)", "[]"),
+            ("release_count", "release r", "r.master_id", "count(*)", "0"),
+        ],
+    ),
+    "label": (
+        "label",
+        [
+            (
+                "sub_labels",
+                "sub_label s",
+                "s.parent_label_id",
+                "list({'id': s.id, 'name': s.label})",
+                "[]",
+            ),
+            ("urls", "label_url u", "u.label_id", "list(u.url)", "[]"),
+        ],
+    ),
+}
+
+
+def build_entity_query(table, children):
+    """
+    One statement per batch: every child table is filtered to the batch ids and
+    aggregated, then joined onto the base rows.
+    """
+    ctes = ["ids AS (SELECT unnest(?::BIGINT[]) AS id)"]
+    columns = ["e.*"]
+    joins = []
+    for column, source, foreign_key, aggregate, default in children:
+        ctes.append(
+            f"{column} AS (SELECT {foreign_key} AS entity_id, {aggregate} AS value "
+            f"FROM {source} WHERE {foreign_key} IN (SELECT id FROM ids) GROUP BY 1)"
+        )
+        columns.append(f"coalesce({column}.value, {default}) AS {column}")
+        joins.append(f"LEFT JOIN {column} ON {column}.entity_id = e.id")
+    return (
+        f"WITH {', '.join(ctes)} SELECT {', '.join(columns)} FROM {table} e "
+        f"{' '.join(joins)} WHERE e.id IN (SELECT id FROM ids)"
+    )
+
+
+entity_queries = {
+    entity_type: build_entity_query(table, children)
+    for entity_type, (table, children) in entity_specs.items()
+}
+
+
+class LRUCache:
+    def __init__(self, max_size=100_000) -> None:
+        self.max_size = max_size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys):
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key in self.items:
+                    self.items.move_to_end(key)
+                    found[key] = self.items[key]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        with self.lock:
+            for key, value in items.items():
+                self.items[key] = value
+                self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+
+class ConnectionPool:
+    """Read-only DuckDB cursors handed out to one thread at a time."""
+
+    def __init__(self, db_file, size=8) -> None:
+        self.base = duckdb.connect(db_file, read_only=True)
+        self.cursors = Queue()
+        for _ in range(size):
+            self.cursors.put(self.base.cursor())
+
+    @contextmanager
+    def connection(self):
+        cursor = self.cursors.get()
+        try:
+            yield cursor
+        finally:
+            self.cursors.put(cursor)
+
+
+class DiscogsLookup:
+    """
+    Batched id lookups over the database built by duck_db.create_tables.
+    Assembled entities (found or not) are kept in a bounded LRU cache.
+    """
+
+    def __init__(self, db_file, pool_size=8, cache_size=100_000) -> None:
+        self.pool = ConnectionPool(db_file, pool_size)
+        self.cache = LRUCache(cache_size)
+
+    def get_entities(self, entity_type, ids):
+        ids = [int(entity_id) for entity_id in ids]
+        cached = self.cache.get_many([(entity_type, i) for i in ids])
+        missing = list({i for i in ids if (entity_type, i) not in cached})
+        fetched = {}
+        if missing:
+            with self.pool.connection() as con:
+                result = con.execute(entity_queries[entity_type], [missing])
+                columns = [column[0] for column in result.description]
+                rows = result.fetchall()
+            fetched = {(entity_type, i): None for i in missing}
+            for row in rows:
+                entity = dict(zip(columns, row))
+                fetched[(entity_type, entity["id"])] = entity
+            self.cache.put_many(fetched)
+        entities = {**cached, **fetched}
+        return [entities[(entity_type, i)] for i in ids]
+
+    def get_releases(self, ids):
+        return self.get_entities("release", ids)
+
+    def get_artists(self, ids):
+        return self.get_entities("artist", ids)
+
+    def get_masters(self, ids):
+        return self.get_entities("master", ids)
+
+    def get_labels(self, ids):
+        return self.get_entities("label", ids)
+
+    def sample_ids(self, entity_type, size):
+        with self.pool.connection() as con:
+            rows = con.execute(
+                f"SELECT id FROM {entity_type} USING SAMPLE {int(size)} ROWS"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def make_handler(lookup):
+    class LookupHandler(BaseHTTPRequestHandler):
+        # GET /releases?ids=1,2,3 (also /artists, /masters, /labels)
+        def do_GET(self):
+            url = urlparse(self.path)
+            entity_type = url.path.strip("/").removesuffix("s")
+            ids = parse_qs(url.query).get("ids", [""])[0]
+            if entity_type not in entity_queries or not ids:
+                self.send_error(
+                    404, "Use /releases, /artists, /masters or /labels?ids=1,2"
+                )
+                return
+            try:
+                id_list = [int(entity_id) for entity_id in ids.split(",")]
+            except ValueError:
+                self.send_error(400, "ids must be integers")
+                return
+            entities = lookup.get_entities(entity_type, id_list)
+            body = json.dumps(dict(zip(map(str, id_list), entities)), default=str)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body.encode())))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    return LookupHandler
+
+
+def benchmark(lookup, entity_type, threads, requests, batch_size, hot_fraction=0.8):
+    """
+    Concurrent batched lookups. hot_fraction of the batches draw from a small hot
+    set, the rest from a larger id sample, so cold and cached paths are both measured.
+    """
+    id_pool = lookup.sample_ids(entity_type, 50_000)
+    hot_ids = id_pool[: max(len(id_pool) // 50, 1)]
+    rng = random.Random(0)
+    batches = [
+        rng.choices(hot_ids if rng.random() < hot_fraction else id_pool, k=batch_size)
+        for _ in range(requests)
+    ]
+
+    def timed_lookup(batch):
+        start_time = time.perf_counter()
+        lookup.get_entities(entity_type, batch)
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = sorted(executor.map(timed_lookup, batches))
+    duration = time.perf_counter() - start_time
+
+    def percentile(p):
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+
+    lookups = lookup.cache.hits + lookup.cache.misses
+    print(
+        f"{entity_type}: {requests} requests x {batch_size} ids on {threads} threads\n"
+        f"  throughput: {requests / duration:.0f} requests/s, "
+        f"{requests * batch_size / duration:.0f} ids/s\n"
+        f"  latency ms: p50 {percentile(0.5):.2f}, p95 {percentile(0.95):.2f}, "
+        f"p99 {percentile(0.99):.2f}, mean {statistics.mean(latencies) * 1000:.2f}\n"
+        f"  cache hit rate: {lookup.cache.hits / lookups if lookups else 0:.1%}"
+    )
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Discogs lookup service")
+    parser.add_argument("--db", help="Directory containing discogs.db", required=True)
+    parser.add_argument("--pool_size", type=int, default=8)
+    parser.add_argument("--cache_size", type=int, default=100_000)
+    parser.add_argument("--serve", action="store_true", help="Start the HTTP endpoint")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--entity", choices=list(entity_queries), default="release")
+    parser.add_argument("--ids", nargs="+", type=int, help="Print these entities")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=5_000)
+    parser.add_argument("--batch_size", type=int, default=20)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    lookup = DiscogsLookup(f"{args.db}/discogs.db", args.pool_size, args.cache_size)
+
+    if args.ids:
+        for entity in lookup.get_entities(args.entity, args.ids):
+            print(json.dumps(entity, default=str))
+    if args.benchmark:
+        benchmark(lookup, args.entity, args.threads, args.requests, args.batch_size)
+    if args.serve:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(lookup))
+        print(f"Serving lookups on http://127.0.0.1:{args.port}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,12 +3,18 @@ from writer import *
 from writers_config import *
 import time
 from downloader import S3DiscogsDowloader
+from sampler import RecordSampler
+from record_cache import RecordCache
+from search_index import setup_search_writers
+from documents import ReleaseDocumentWriter
+from profiler import SamplingProfiler, write_combined_profile
+from scheduler import JobScheduler, process_context
+from contextlib import nullcontext
 from pathlib import Path
 import os
 from tqdm import tqdm
 import argparse
-import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 
 bucket_name = "discogs-data-dumps"
 prefix = "data/"
@@ -27,35 +33,150 @@ def get_args():
         help="To only process a sample of the data (50k)",
         action="store_true",
     )
+    parser.add_argument(
+        "--sample_mode",
+        choices=RecordSampler.modes,
+        help="How sampled records are chosen, implies --sample (default: head, the first records of each dump)",
+    )
+    parser.add_argument(
+        "--sample_size",
+        type=int,
+        help="Number of records to sample per dump, implies --sample (default: 50000)",
+    )
+    parser.add_argument(
+        "--sample_seed",
+        type=int,
+        help="Random seed for reproducible samples, implies --sample",
+    )
+    parser.add_argument(
+        "--stratify_by",
+        choices=["genre", "year"],
+        help="Stratum used by --sample_mode stratified (default: genre)",
+    )
     parser.add_argument(
         "--download",
         action="store_true",
         help="Option to download most recent data dumps",
         required=False,
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Sample each job and write flamegraph stacks and hot function tables to <dir>/profile",
+        required=False,
+    )
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=sorted(writer_tables.values()),
+        help="Only write these tables, parsing only the data they need",
+        required=False,
+    )
+    parser.add_argument(
+        "--documents",
+        choices=["jsonl", "parquet"],
+        help="Also write one nested document per release to <dir>/release_document",
+        required=False,
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Write per table column statistics and sketches to <dir>/stats",
+        required=False,
+    )
+    parser.add_argument(
+        "--search_index",
+        action="store_true",
+        help="Build the artist/label/release name search index in <dir>/search",
+        required=False,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Cache parsed records here and replay them on later runs instead of re-parsing",
+        required=False,
+    )
+    parser.add_argument(
+        "--max_workers",
+        type=int,
+        help="Upper bound on concurrent jobs (default: available cores)",
+        required=False,
+    )
+    parser.add_argument(
+        "--worker_memory",
+        type=float,
+        default=1.0,
+        help="GB assumed per process worker until a job's peak memory has been measured",
+        required=False,
+    )
+    parser.add_argument(
+        "--timings",
+        help="Job timings file used to order jobs (default: <dir>/job_timings.json)",
+        required=False,
+    )
     args = parser.parse_args()
+    sample_options = [args.sample_mode, args.sample_size, args.sample_seed]
+    if any(option is not None for option in sample_options):
+        args.sample = True
+    if args.stratify_by and args.sample_mode != "stratified":
+        parser.error("--stratify_by requires --sample_mode stratified")
+    args.sample_mode = args.sample_mode or "head"
+    args.sample_size = 50_000 if args.sample_size is None else args.sample_size
+    args.stratify_by = args.stratify_by or "genre"
     return args
 
 
-def get_parsers(raw_data_path, args):
-    files_and_parsers = {
-        "label": ("discogs_20240701_labels.xml.gz", LabelParser),
-        "artist": ("discogs_20240701_artists.xml.gz", ArtistParser),
-        "release": ("discogs_20240701_releases.xml.gz", ReleaseParser),
-        "master": ("discogs_20240701_masters.xml.gz", MasterParser),
-    }
+def get_parsers(raw_data_path, args, cache=None):
+    tables = args.tables
+    if tables is not None and args.documents:
+        tables = [*tables, "release_document"]
     parsers = {}
     for key, (filename, parser) in files_and_parsers.items():
         file_path = raw_data_path / filename
-        parsers[key.split("_")[0]] = parser(file_path=file_path, sample=args.sample)
+        sampler = RecordSampler(
+            mode=args.sample_mode,
+            size=args.sample_size,
+            seed=args.sample_seed,
+            stratify_by=args.stratify_by,
+        )
+        parsers[key.split("_")[0]] = parser(
+            file_path=file_path,
+            sample=args.sample,
+            sampler=sampler,
+            cache=cache,
+            tables=tables,
+        )
     return parsers
 
 
-def process_data(writer, parser):
+def select_samples(parsers, max_workers, cache=None):
+    # Process workers each get a copy of the parser, so every dump's sample is
+    # drawn once up front instead of once per job. Cached samples are replayed.
+    parsers = {
+        key: parser
+        for key, parser in parsers.items()
+        if cache is None or not cache.has(parser)
+    }
+    if not parsers:
+        return
+    with ProcessPoolExecutor(
+        max_workers=min(len(parsers), max_workers), mp_context=process_context()
+    ) as executor:
+        futures = {
+            key: executor.submit(parser.sampler.select, parser.file_path, parser.tag)
+            for key, parser in parsers.items()
+        }
+    for key, future in futures.items():
+        parsers[key].sample_indices = future.result()
+
+
+def process_data(writer, parser, profile_dir=None):
     start_time = time.time()
-    parsed_data = parser.parse_file()
-    writer.write_rows(parsed_data)
-    writer.close_file()
+    job_name = Path(writer.file_name).stem
+    profiler = SamplingProfiler(job_name, profile_dir) if profile_dir else nullcontext()
+    with profiler:
+        parsed_data = parser.parse_file()
+        writer.write_rows(parsed_data)
+        writer.close_file()
     end_time = time.time()
     duration = (end_time - start_time) / 60
     return f"{writer.__class__.__name__} completed in {duration:.2f} minutes."
@@ -72,25 +193,74 @@ def main():
     csv_path = base_path / args.dir if args.dir else None
     os.makedirs(csv_path, exist_ok=True)
     raw_data_path = base_path / args.raw_dir if args.raw_dir else base_path / "raw_data"
-    writers = setup_writers(csv_path=csv_path)
-    parsers = get_parsers(raw_data_path, args)
-    with ThreadPoolExecutor(max_workers=len(parsers)) as executor:
-        futures = {}
-        for writer_name, writer in writers.items():
-            base_category = writer_name.split("_")[0]
-            if base_category in parsers:
-                future = executor.submit(process_data, writer, parsers[base_category])
-                futures[future] = writer_name
-            else:
-                print(f"No parser available for {base_category}")
-
-        for future in as_completed(futures):
-            writer_name = futures[future]
-            try:
-                result = future.result()
-                print(f"{writer_name}: {result}")
-            except Exception as exc:
-                print(f"Error processing {writer_name}: {exc}")
+    writers = setup_writers(csv_path=csv_path, tables=args.tables)
+    if args.stats:
+        for writer in writers.values():
+            writer.enable_stats(csv_path / "stats")
+    if args.search_index:
+        writers.update(setup_search_writers(csv_path / "search"))
+    cache = RecordCache(base_path / args.cache_dir) if args.cache_dir else None
+    parsers = get_parsers(raw_data_path, args, cache)
+    if args.documents:
+        # Names and years are read back from this run's artist and master CSVs,
+        # a dump is only parsed again when its table is not written.
+        source_files = {
+            name: writers[name].file_name
+            for name in ["artist_writer", "master_writer"]
+            if name in writers
+        }
+        writers["release_document_writer"] = ReleaseDocumentWriter(
+            file_name=f"{csv_path}/release_document",
+            artist_parser=parsers["artist"],
+            master_parser=parsers["master"],
+            output_format=args.documents,
+            artist_csv=source_files.get("artist_writer"),
+            master_csv=source_files.get("master_writer"),
+        )
+    profile_dir = csv_path / "profile" if args.profile else None
+    scheduler = JobScheduler(
+        timings_path=args.timings or csv_path / "job_timings.json",
+        sample=args.sample,
+        max_workers=args.max_workers,
+        worker_memory=int(args.worker_memory * 2**30),
+    )
+    used_parsers = {}
+    for writer_name, writer in writers.items():
+        base_category = writer_name.split("_")[0]
+        if base_category in parsers:
+            parser = parsers[base_category]
+            used_parsers[base_category] = parser
+            inputs = [parser.file_path]
+            after = []
+            if isinstance(writer, ReleaseDocumentWriter):
+                after = list(source_files)
+                if writer.artist_csv is None:
+                    used_parsers["artist"] = writer.artist_parser
+                    inputs.append(writer.artist_parser.file_path)
+                if writer.master_csv is None:
+                    used_parsers["master"] = writer.master_parser
+                    inputs.append(writer.master_parser.file_path)
+            scheduler.add(
+                writer_name,
+                process_data,
+                (writer, parser, profile_dir),
+                inputs,
+                after=after,
+            )
+        else:
+            print(f"No parser available for {base_category}")
+    if args.sample and args.sample_mode != "head":
+        select_samples(used_parsers, scheduler.budget(), cache)
+
+    for writer_name, result, exc in scheduler.run():
+        if exc is None:
+            print(f"{writer_name}: {result}")
+        else:
+            print(f"Error processing {writer_name}: {exc}")
+
+    if profile_dir:
+        write_combined_profile(profile_dir)
+        print(f"Profiles written to {profile_dir}")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import gzip
 import os
+import re
+import threading
 from lxml import etree
+from sampler import RecordSampler, iterate_raw_records
 
 
 class ParserUtils:
@@ -46,6 +49,13 @@ class ParserUtils:
             return []
         return [alias.text for alias in aliases_element if alias.text is not None]
 
+    @staticmethod
+    def parse_alias_ids(element):
+        aliases_element = element.find("aliases")
+        if aliases_element is None:
+            return []
+        return [alias.get("id") for alias in aliases_element if alias.text is not None]
+
     @staticmethod
     def parse_videos(element, element_type="release"):
         video_element_parent = element.find("videos")
@@ -67,43 +77,139 @@ class ParserUtils:
 
 
 class BaseParser:
-    def __init__(self, file_path, sample=False) -> None:
+    tag = None
+    # Bump to invalidate cached records when parsing output changes.
+    version = 1
+    # Output table -> extraction methods it needs, for parsers that support projection.
+    table_extractors = {}
+    required_extractors = []
+    # Extraction method -> child elements only it reads, dropped before tree building.
+    extractor_subtrees = {}
+
+    def __init__(
+        self, file_path, sample=False, sampler=None, cache=None, tables=None
+    ) -> None:
         self.file_path = file_path
         self.check_file_exists()
         self.sample = sample
+        self.sampler = sampler or RecordSampler()
+        self.cache = cache
+        self.sample_indices = None
+        self.sample_lock = threading.Lock()
+        self.tables = tables
+        self.extractor_names = self.select_extractors(tables)
+        self.extractors = [getattr(self, name) for name in self.extractor_names]
+        self.prune_pattern = self.build_prune_pattern()
+
+    def __getstate__(self):
+        # Parsers are shipped to process workers, locks and bound methods are rebuilt there.
+        state = self.__dict__.copy()
+        del state["sample_lock"], state["extractors"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.sample_lock = threading.Lock()
+        self.extractors = [getattr(self, name) for name in self.extractor_names]
 
     def check_file_exists(self):
         if not os.path.isfile(self.file_path):
             raise FileNotFoundError(f"File does not exist: {self.file_path}")
 
+    def select_extractors(self, tables):
+        names = list(self.required_extractors)
+        for table, extractors in self.table_extractors.items():
+            if tables is None or table in tables:
+                names.extend(name for name in extractors if name not in names)
+        return names
+
+    def build_prune_pattern(self):
+        needed = {
+            subtree
+            for name in self.extractor_names
+            for subtree in self.extractor_subtrees.get(name, [])
+        }
+        subtrees = {
+            subtree: None
+            for name, names in self.extractor_subtrees.items()
+            if name not in self.extractor_names
+            for subtree in names
+            if subtree not in needed
+        }
+        if not subtrees:
+            return None
+        alternatives = "|".join(re.escape(subtree) for subtree in subtrees)
+        return re.compile(rf"<({alternatives})>.*?</\1>".encode(), re.S)
+
+    def build_element(self, raw):
+        if self.prune_pattern is not None:
+            raw = self.prune_pattern.sub(b"", raw)
+        return etree.fromstring(raw)
+
     def iterate_and_decompress_xml(self):
         with gzip.open(self.file_path, "rb") as f:
             context = etree.iterparse(f, events=("end",), tag=self.tag)
             for i, (_, element) in enumerate(context):
+                if self.sample and i >= self.sampler.size:
+                    break
                 if element is not None:
                     yield element
                     if element.tag not in ["label", "sublabels"]:
                         element.clear()
                     while element.getprevious() is not None:
                         del element.getparent()[0]
-                    if self.sample:
-                        if i >= 50_000:
-                            break
 
-    def parse_file(self):
-        for element in self.iterate_and_decompress_xml():
+    def get_sample_indices(self):
+        # Every writer of a category shares this parser, so the selection is made
+        # once and all child tables are written from the same sampled records.
+        with self.sample_lock:
+            if self.sample_indices is None:
+                self.sample_indices = self.sampler.select(self.file_path, self.tag)
+        return self.sample_indices
+
+    def iterate_sampled_xml(self):
+        indices = self.get_sample_indices()
+        for raw in self.sampler.iterate(self.file_path, self.tag, indices):
+            yield self.build_element(raw)
+
+    def iterate_pruned_xml(self):
+        # Unneeded subtrees are cut from the raw record, so lxml never builds them.
+        for i, raw in enumerate(iterate_raw_records(self.file_path, self.tag)):
+            if self.sample and i >= self.sampler.size:
+                break
+            yield self.build_element(raw)
+
+    def iterate_elements(self):
+        if self.sample and self.sampler.mode != "head":
+            return self.iterate_sampled_xml()
+        if self.prune_pattern is not None:
+            return self.iterate_pruned_xml()
+        return self.iterate_and_decompress_xml()
+
+    def parse_records(self):
+        for element in self.iterate_elements():
             parsed_data = self.parse_elements(element)
             if parsed_data:
                 yield parsed_data
 
+    def parse_file(self):
+        records = self.parse_records()
+        if self.cache is None:
+            return records
+        return self.cache.wrap(self, records)
+
     def parse_elements(self, element):
         raise NotImplementedError("Subclasses should implement this method")
 
+    def extract(self, element):
+        data = {}
+        for extractor in self.extractors:
+            data.update(extractor(element))
+        return data
+
 
 class LabelParser(BaseParser):
-    def __init__(self, file_path, sample=False) -> None:
-        super().__init__(file_path, sample)
-        self.tag = "label"
+    tag = "label"
 
     def parse_sub_labels(self, element, parent_label_id):
         sub_label_element = element.findall("sublabels/label")
@@ -150,9 +256,7 @@ class LabelParser(BaseParser):
 
 
 class ArtistParser(BaseParser):
-    def __init__(self, file_path, sample=False) -> None:
-        super().__init__(file_path, sample)
-        self.tag = "artist"
+    tag = "artist"
 
     def parse_name_variations(self, element):
         name_var_element = element.find("namevariations")
@@ -183,14 +287,40 @@ class ArtistParser(BaseParser):
             **self.parse_artist(element),
             "urls": ParserUtils.parse_urls(element),
             "aliases": ParserUtils.parse_aliases(element),
+            "alias_ids": ParserUtils.parse_alias_ids(element),
             "name_variations": self.parse_name_variations(element),
         }
 
 
 class ReleaseParser(BaseParser):
-    def __init__(self, file_path, sample=False) -> None:
-        super().__init__(file_path, sample)
-        self.tag = "release"
+    tag = "release"
+    table_extractors = {
+        "release": ["parse_release", "parse_release_label", "parse_formats"],
+        "release_artist": ["parse_release_artists"],
+        "release_extra_artist": ["parse_release_extra_artist"],
+        "release_genre": ["parse_genre_styles"],
+        "release_style": ["parse_genre_styles"],
+        "release_track": ["parse_tracks"],
+        "release_video": ["parse_videos"],
+        "release_company": ["parse_release_company"],
+        "release_document": [
+            "parse_release_label",
+            "parse_formats",
+            "parse_artist_credits",
+            "parse_genre_styles",
+            "parse_tracks",
+            "parse_videos",
+            "parse_release_company",
+        ],
+    }
+    required_extractors = ["parse_release"]
+    extractor_subtrees = {
+        "parse_release_extra_artist": ["extraartists"],
+        "parse_artist_credits": ["extraartists"],
+        "parse_tracks": ["tracklist"],
+        "parse_videos": ["videos"],
+        "parse_release_company": ["companies"],
+    }
 
     def parse_release_extra_artist(self, element):
         if element is None:
@@ -210,6 +340,24 @@ class ReleaseParser(BaseParser):
             "extra_artist_roles": roles,
         }
 
+    def parse_artist_credits(self, element):
+        # One tuple per artist, a missing <anv> or <role> can't shift later artists.
+        return {
+            key: [
+                (
+                    artist.findtext("id"),
+                    artist.findtext("name"),
+                    artist.findtext("anv") or None,
+                    artist.findtext("role") or None,
+                )
+                for artist in element.iterfind(path)
+            ]
+            for key, path in [
+                ("artist_credits", "artists/artist"),
+                ("extra_artist_credits", "extraartists/artist"),
+            ]
+        }
+
     def parse_release_artists(self, element):
         if element is None:
             return {}
@@ -217,12 +365,10 @@ class ReleaseParser(BaseParser):
         artist = ParserUtils.find_text(artist_element, "name")
         artist_id = ParserUtils.find_text(artist_element, "id")
         join_text = "".join(ParserUtils.find_text(artist_element, "join"))
-        extra_artist = self.parse_release_extra_artist(element)
         return {
             "artist": artist,
             "artist_id": artist_id,
             "join_text": join_text,
-            **extra_artist,
         }
 
     def parse_release_label(self, element):
@@ -300,23 +446,30 @@ class ReleaseParser(BaseParser):
             "track_duration": track_duration,
         }
 
+    def parse_genre_styles(self, element):
+        return ParserUtils.parse_genre_styles(element)
+
+    def parse_videos(self, element):
+        return ParserUtils.parse_videos(element, element_type="release")
+
     def parse_elements(self, element):
-        return {
-            **self.parse_release(element),
-            **self.parse_release_artists(element),
-            **self.parse_release_label(element),
-            **self.parse_formats(element),
-            **ParserUtils.parse_genre_styles(element),
-            **self.parse_tracks(element),
-            **ParserUtils.parse_videos(element, element_type="release"),
-            **self.parse_release_company(element),
-        }
+        return self.extract(element)
 
 
 class MasterParser(BaseParser):
-    def __init__(self, file_path, sample=False) -> None:
-        super().__init__(file_path, sample)
-        self.tag = "master"
+    tag = "master"
+    table_extractors = {
+        "master": ["parse_master_release"],
+        "master_artist": ["parse_master_artist"],
+        "master_video": ["parse_videos"],
+        "master_genre": ["parse_genre_styles"],
+        "master_style": ["parse_genre_styles"],
+    }
+    required_extractors = ["parse_master_release"]
+    extractor_subtrees = {
+        "parse_master_artist": ["artists"],
+        "parse_videos": ["videos"],
+    }
 
     def parse_master_artist(self, element):
         if element is None:
@@ -350,10 +503,11 @@ class MasterParser(BaseParser):
             "data_quality": data_quality,
         }
 
+    def parse_genre_styles(self, element):
+        return ParserUtils.parse_genre_styles(element)
+
+    def parse_videos(self, element):
+        return ParserUtils.parse_videos(element, element_type="master")
+
     def parse_elements(self, element):
-        return {
-            **self.parse_master_release(element),
-            **self.parse_master_artist(element),
-            **ParserUtils.parse_videos(element, element_type="master"),
-            **ParserUtils.parse_genre_styles(element),
-        }
+        return self.extract(element)
@@ -0,0 +1,132 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """
+    Low overhead sampling profiler attached to a single worker thread.
+    Writes collapsed stacks (for flamegraph.pl / speedscope) and a hot function table.
+    """
+
+    focus_modules = ("parser.py", "writer.py")
+
+    def __init__(self, name, output_dir, interval=0.01, top_n=30) -> None:
+        self.name = name
+        self.output_dir = output_dir
+        self.interval = interval
+        self.top_n = top_n
+        self.stacks = Counter()
+        self.samples = 0
+        self.target_id = None
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+        self.write_reports()
+
+    def start(self, thread_id=None):
+        self.target_id = thread_id or threading.get_ident()
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self.sample_loop, name=f"profiler-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def sample_loop(self):
+        # Only code objects are recorded while sampling, formatting is deferred
+        # to write_reports so the target thread is interrupted as little as possible.
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.target_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    @staticmethod
+    def format_code(code):
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def collapsed_stacks(self):
+        collapsed = Counter()
+        for stack, count in self.stacks.items():
+            collapsed[";".join(self.format_code(code) for code in stack)] += count
+        return collapsed
+
+    def hot_functions(self):
+        total, own = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            for name in {self.format_code(code) for code in stack}:
+                total[name] += count
+            own[self.format_code(stack[-1])] += count
+        return total, own
+
+    def format_table(self, functions, total, own):
+        seconds_per_sample = self.elapsed / self.samples if self.samples else 0
+        lines = [f"{'total %':>8} {'self %':>8} {'total s':>9}  function"]
+        for name in functions:
+            lines.append(
+                f"{100 * total[name] / self.samples:>7.2f}% "
+                f"{100 * own[name] / self.samples:>7.2f}% "
+                f"{total[name] * seconds_per_sample:>9.2f}  {name}"
+            )
+        return lines
+
+    def write_reports(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(f"{self.output_dir}/{self.name}.folded", "w") as f:
+            for stack, count in self.collapsed_stacks().most_common():
+                f.write(f"{stack} {count}\n")
+
+        total, own = self.hot_functions()
+        focus = [
+            name
+            for name, _ in total.most_common()
+            if name.startswith(self.focus_modules)
+        ]
+        lines = [
+            f"{self.name}: {self.samples} samples over {self.elapsed:.2f}s "
+            f"(interval {self.interval * 1000:.0f}ms)",
+            "",
+            f"Top {self.top_n} functions:",
+            *self.format_table(
+                [name for name, _ in own.most_common(self.top_n)], total, own
+            ),
+            "",
+            "Parser / writer hot paths:",
+            *self.format_table(focus, total, own),
+        ]
+        with open(f"{self.output_dir}/{self.name}_hot.txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+def write_combined_profile(output_dir, file_name="all.folded"):
+    """Merge every job's collapsed stacks into one flamegraph rooted at the job name."""
+    os.makedirs(output_dir, exist_ok=True)
+    with open(f"{output_dir}/{file_name}", "w") as out:
+        for name in sorted(os.listdir(output_dir)):
+            if not name.endswith(".folded") or name == file_name:
+                continue
+            job_name = name[: -len(".folded")]
+            with open(f"{output_dir}/{name}") as f:
+                for line in f:
+                    out.write(f"{job_name};{line}")
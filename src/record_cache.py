@@ -0,0 +1,132 @@
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from pathlib import Path
+
+
+class RecordCache:
+    """
+    On-disk cache of a parser's record stream, stored as pickled batches.
+    Entries are keyed by the dump file and the parser version, and a change
+    to either (including edits to the parser module) invalidates them. Runs
+    with other tables or sample settings get entries of their own next to them.
+    """
+
+    def __init__(self, cache_dir, batch_size=1_000) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.batch_size = batch_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def parser_version(parser):
+        source_file = inspect.getsourcefile(type(parser))
+        with open(source_file, "rb") as f:
+            source_digest = hashlib.sha1(f.read()).hexdigest()
+        return f"{parser.version}-{source_digest}"
+
+    @staticmethod
+    def digest(key_data):
+        return hashlib.sha1(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+    def source_key(self, parser):
+        """Identifies the dump and parser version, entries with another one are stale."""
+        stat = os.stat(parser.file_path)
+        source_data = {
+            "file": os.path.abspath(parser.file_path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "parser": type(parser).__name__,
+            "version": self.parser_version(parser),
+        }
+        return self.digest(source_data)[:16]
+
+    def key(self, parser):
+        sampler = parser.sampler
+        if parser.sample and sampler.mode != "head" and sampler.seed is None:
+            # An unseeded random sample can't be reproduced, so it is never cached.
+            return None
+        variant_data = {
+            "extractors": parser.extractor_names,
+            "sample": (
+                [sampler.mode, sampler.size, sampler.seed, sampler.stratify_by]
+                if parser.sample
+                else None
+            ),
+        }
+        return f"{self.source_key(parser)}.{self.digest(variant_data)[:16]}"
+
+    def prefix(self, parser):
+        return f"{Path(parser.file_path).name}.{type(parser).__name__}"
+
+    def path_for(self, parser):
+        key = self.key(parser)
+        if key is None:
+            return None
+        return self.cache_dir / f"{self.prefix(parser)}.{key}.pkl"
+
+    def has(self, parser):
+        path = self.path_for(parser)
+        return path is not None and path.exists()
+
+    def wrap(self, parser, records):
+        """Replays the cached records if present, otherwise caches records as they stream."""
+        path = self.path_for(parser)
+        if path is None:
+            return records
+        if path.exists():
+            return self.read(path)
+        return self.write(parser, path, records)
+
+    def read(self, path):
+        with open(path, "rb", buffering=1 << 20) as f:
+            while True:
+                try:
+                    batch = pickle.load(f)
+                except EOFError:
+                    break
+                yield from batch
+
+    def write(self, parser, path, records):
+        # Only one builder per entry, other concurrent readers of the same dump
+        # parse normally. flock is released automatically if the builder dies.
+        lock_file = open(f"{path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            yield from records
+            return
+
+        tmp_path = path.with_suffix(f".tmp-{os.getpid()}")
+        try:
+            if path.exists():
+                yield from self.read(path)
+                return
+            with open(tmp_path, "wb", buffering=1 << 20) as f:
+                batch = []
+                for record in records:
+                    batch.append(record)
+                    if len(batch) >= self.batch_size:
+                        pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        batch = []
+                    yield record
+                if batch:
+                    pickle.dump(batch, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.remove_stale(parser)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            lock_file.close()
+
+    def remove_stale(self, parser):
+        # Only entries of an older dump or parser version, a projected or sampled
+        # run must not evict the full entry of the same dump.
+        current = f"{self.prefix(parser)}.{self.source_key(parser)}."
+        for stale_path in self.cache_dir.glob(f"{self.prefix(parser)}.*.pkl"):
+            if not stale_path.name.startswith(current):
+                stale_path.unlink(missing_ok=True)
+                Path(f"{stale_path}.lock").unlink(missing_ok=True)
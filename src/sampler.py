@@ -0,0 +1,145 @@
+import gzip
+import random
+import re
+from array import array
+from collections import Counter
+
+READ_SIZE = 1 << 20
+
+
+def iterate_raw_records(file_path, tag):
+    """
+    Yields the raw bytes of every top level <tag> record in a gzipped dump.
+    Only tag boundaries are scanned, no lxml tree is built.
+    """
+    pattern = re.compile(rb"<(/?)" + re.escape(tag.encode()) + rb"[\s>/]")
+    with gzip.open(file_path, "rb") as f:
+        buffer = b""
+        scan_from = 0
+        depth = 0
+        start = 0
+        while True:
+            chunk = f.read(READ_SIZE)
+            if not chunk:
+                break
+            buffer += chunk
+            for match in pattern.finditer(buffer, scan_from):
+                tag_end = buffer.find(b">", match.end() - 1)
+                if tag_end == -1:
+                    break
+                scan_from = tag_end + 1
+                if match.group(1):
+                    depth -= 1
+                    if depth == 0:
+                        yield buffer[start:scan_from]
+                elif buffer[tag_end - 1 : tag_end] == b"/":
+                    if depth == 0:
+                        yield buffer[match.start() : scan_from]
+                else:
+                    if depth == 0:
+                        start = match.start()
+                    depth += 1
+            # Keep the unfinished record (or partial tag) for the next chunk.
+            keep_from = start if depth else scan_from
+            buffer = buffer[keep_from:]
+            scan_from -= keep_from
+            start -= keep_from
+
+
+class RecordSampler:
+    """
+    Chooses which records of a dump end up in a sample.
+    Selection runs over raw record bytes, so only the sampled records are parsed.
+    """
+
+    modes = ("head", "reservoir", "every_nth", "stratified")
+    strata_patterns = {
+        "genre": {
+            "release": re.compile(rb"<genre>([^<]*)</genre>"),
+            "master": re.compile(rb"<genre>([^<]*)</genre>"),
+        },
+        "year": {
+            "release": re.compile(rb"<released>(\d{4})"),
+            "master": re.compile(rb"<year>(\d{4})"),
+        },
+    }
+
+    def __init__(self, mode="head", size=50_000, seed=None, stratify_by="genre"):
+        if mode not in self.modes:
+            raise ValueError(f"Unknown sample mode: {mode}")
+        self.mode = mode
+        self.size = size
+        self.seed = seed
+        self.stratify_by = stratify_by
+
+    def select(self, file_path, tag):
+        """Returns the sorted record indices to keep from file_path."""
+        rng = random.Random(self.seed)
+        records = iterate_raw_records(file_path, tag)
+        if self.mode == "reservoir":
+            return sorted(self.reservoir(enumerate(records), rng))
+        if self.mode == "every_nth":
+            total = sum(1 for _ in records)
+            step = max(total // self.size, 1)
+            return range(rng.randrange(step), total, step)[: self.size]
+        if self.mode == "stratified":
+            return self.stratified(records, tag, rng)
+        return range(self.size)
+
+    def reservoir(self, indexed_records, rng):
+        reservoir = array("q")
+        for i, _ in indexed_records:
+            if i < self.size:
+                reservoir.append(i)
+            else:
+                j = rng.randrange(i + 1)
+                if j < self.size:
+                    reservoir[j] = i
+        return reservoir
+
+    def stratified(self, records, tag, rng):
+        pattern = self.strata_patterns[self.stratify_by].get(tag)
+        reservoirs = {}
+        counts = Counter()
+        for i, raw in enumerate(records):
+            match = pattern.search(raw) if pattern else None
+            stratum = match.group(1) if match else None
+            seen = counts[stratum]
+            counts[stratum] += 1
+            reservoir = reservoirs.setdefault(stratum, array("q"))
+            if seen < self.size:
+                reservoir.append(i)
+            else:
+                j = rng.randrange(seen + 1)
+                if j < self.size:
+                    reservoir[j] = i
+
+        # Proportional allocation, remainders go to the largest fractional shares.
+        total = sum(counts.values())
+        shares = {s: self.size * c / total for s, c in counts.items()}
+        quotas = {s: min(int(share), counts[s]) for s, share in shares.items()}
+        remaining = min(self.size, total) - sum(quotas.values())
+        for stratum in sorted(
+            shares, key=lambda s: shares[s] - quotas[s], reverse=True
+        ):
+            if remaining <= 0:
+                break
+            if quotas[stratum] < counts[stratum]:
+                quotas[stratum] += 1
+                remaining -= 1
+
+        selected = []
+        for stratum, quota in quotas.items():
+            selected.extend(rng.sample(list(reservoirs[stratum]), quota))
+        return sorted(selected)
+
+    def iterate(self, file_path, tag, indices):
+        """Yields the raw bytes of the records at the given sorted indices."""
+        wanted = iter(indices)
+        next_index = next(wanted, None)
+        for i, raw in enumerate(iterate_raw_records(file_path, tag)):
+            if next_index is None:
+                break
+            if i == next_index:
+                yield raw
+                next_index = next(wanted, None)
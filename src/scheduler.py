@@ -0,0 +1,280 @@
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory():
+    """MemAvailable in bytes, None if it can't be read."""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def process_context():
+    # Fork where available, so workers don't re-import main.py and its dependencies.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def reset_peak_memory():
+    # Linux only, elsewhere the peak stays the worker's peak over all its jobs.
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_memory():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def run_job(function, args):
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start_time, peak_memory()
+
+
+def run_process_job(function, args):
+    # Workers are reused, so the peak is reset to make it this job's own.
+    reset_peak_memory()
+    return run_job(function, args)
+
+
+class Job:
+    def __init__(self, name, function, args, inputs, executor=None, after=()) -> None:
+        self.name = name
+        self.function = function
+        self.args = args
+        self.inputs = inputs
+        self.executor = executor
+        self.after = set(after)
+        self.size = sum(
+            os.path.getsize(path) for path in inputs if os.path.isfile(path)
+        )
+        self.cost = None
+
+
+class JobTimings:
+    """
+    Durations and peak memory of past jobs, keyed by job name and whether the
+    run was sampled. Full run durations are scaled by the current input size.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self.timings = {}
+        if path and os.path.isfile(path):
+            with open(path) as f:
+                self.timings = json.load(f)
+
+    @staticmethod
+    def key(job, sample):
+        return f"{job.name}:{'sample' if sample else 'full'}"
+
+    def estimate(self, job, sample):
+        timing = self.timings.get(self.key(job, sample))
+        if timing is None:
+            return None
+        if sample or not timing["bytes"]:
+            return timing["seconds"]
+        return timing["seconds"] * job.size / timing["bytes"]
+
+    def memory(self, job, sample):
+        timing = self.timings.get(self.key(job, sample))
+        return timing.get("peak_memory") if timing else None
+
+    def record(self, job, sample, seconds, peak_memory=None):
+        self.timings[self.key(job, sample)] = {
+            "seconds": round(seconds, 3),
+            "bytes": job.size,
+            "peak_memory": peak_memory,
+        }
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.timings, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class JobScheduler:
+    """
+    Runs jobs longest first (LPT) on a process pool for heavy parsing jobs and a
+    thread pool for short or I/O bound ones. Cost is the past duration of the job
+    scaled to its current input size, or the input size itself when the job has
+    never run. Process workers are capped by cores and by available memory.
+    A job added with after= is only submitted once those jobs have finished.
+    """
+
+    # Seconds per input byte for jobs without history, roughly one parse of the dump.
+    default_rate = 1e-7
+    # Jobs estimated below this run on threads, a process would cost more than it saves.
+    min_process_seconds = 5.0
+
+    def __init__(
+        self, timings_path=None, sample=False, max_workers=None, worker_memory=2**30
+    ) -> None:
+        self.timings = JobTimings(timings_path)
+        self.sample = sample
+        self.max_workers = max_workers
+        self.worker_memory = worker_memory
+        self.jobs = []
+
+    def add(self, name, function, args, inputs, executor=None, after=()):
+        """
+        executor is "process", "thread" or None to decide from the estimated cost.
+        after names jobs whose outputs this job reads.
+        """
+        self.jobs.append(Job(name, function, args, inputs, executor, after))
+
+    def plan(self):
+        for job in self.jobs:
+            estimate = self.timings.estimate(job, self.sample)
+            job.cost = (
+                estimate if estimate is not None else job.size * self.default_rate
+            )
+            if job.executor is None:
+                job.executor = (
+                    "process" if job.cost >= self.min_process_seconds else "thread"
+                )
+        self.jobs.sort(key=lambda job: job.cost, reverse=True)
+        process_jobs = [job for job in self.jobs if job.executor == "process"]
+        thread_jobs = [job for job in self.jobs if job.executor == "thread"]
+        return process_jobs, thread_jobs
+
+    def budget(self):
+        return self.max_workers or available_cpus()
+
+    def process_workers(self, process_jobs, thread_jobs):
+        if not process_jobs:
+            return 0
+        workers = min(self.budget(), len(process_jobs))
+        if thread_jobs:
+            # One slot of the budget is left to the thread pool.
+            workers = min(workers, self.budget() - 1)
+        memory = available_memory()
+        if memory is not None:
+            per_worker = max(
+                self.timings.memory(job, self.sample) or self.worker_memory
+                for job in process_jobs
+            )
+            workers = min(workers, max(memory // per_worker, 1))
+        return max(workers, 1)
+
+    def thread_workers(self, thread_jobs, process_workers):
+        if not thread_jobs:
+            return 0
+        # Threads share one interpreter, so they only get the cores processes leave.
+        spare = self.budget() - process_workers
+        return min(max(spare, 0), len(thread_jobs))
+
+    def run(self):
+        """Yields (job name, result, exception) as jobs finish and saves their timings."""
+        process_jobs, thread_jobs = self.plan()
+        n_processes = self.process_workers(process_jobs, thread_jobs)
+        n_threads = self.thread_workers(thread_jobs, n_processes)
+        if thread_jobs and not n_threads:
+            # A budget of one worker, the short jobs queue behind the others.
+            for job in thread_jobs:
+                job.executor = "process"
+            process_jobs, thread_jobs = process_jobs + thread_jobs, []
+        total = sum(job.cost for job in self.jobs)
+        longest = self.jobs[0].cost if self.jobs else 0
+        print(
+            f"Scheduling {len(self.jobs)} jobs on {n_processes} processes and "
+            f"{n_threads} threads, estimated {total:.0f}s of work, "
+            f"longest job {longest:.0f}s"
+        )
+        executors = {}
+        futures = {}
+        names = {job.name for job in self.jobs}
+        waiting = list(self.jobs)
+        finished, failed = set(), set()
+        try:
+            for jobs, executor_class, workers in [
+                (process_jobs, ProcessPoolExecutor, n_processes),
+                (thread_jobs, ThreadPoolExecutor, n_threads),
+            ]:
+                if not jobs:
+                    continue
+                options = {}
+                if executor_class is ProcessPoolExecutor:
+                    options["mp_context"] = process_context()
+                executors[jobs[0].executor] = executor_class(
+                    max_workers=workers, **options
+                )
+            while waiting or futures:
+                # Submission order is execution order, so the longest jobs start first.
+                for job in list(waiting):
+                    after = job.after & names
+                    if not after <= finished | failed:
+                        continue
+                    waiting.remove(job)
+                    if after & failed:
+                        failed.add(job.name)
+                        missing = ", ".join(sorted(after & failed))
+                        yield job.name, None, RuntimeError(f"{missing} failed")
+                        continue
+                    runner = run_process_job if job.executor == "process" else run_job
+                    future = executors[job.executor].submit(
+                        runner, job.function, job.args
+                    )
+                    futures[future] = job
+                if not futures:
+                    if waiting:
+                        cycle = ", ".join(job.name for job in waiting)
+                        raise ValueError(f"Circular job dependencies: {cycle}")
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = futures.pop(future)
+                    try:
+                        result, seconds, memory = future.result()
+                    except Exception as exc:
+                        failed.add(job.name)
+                        yield job.name, None, exc
+                        continue
+                    finished.add(job.name)
+                    if job.executor == "thread":
+                        memory = None
+                    self.timings.record(job, self.sample, seconds, memory)
+                    yield job.name, result, None
+        finally:
+            for executor in executors.values():
+                executor.shutdown()
+            self.timings.save()
@@ -0,0 +1,313 @@
+import argparse
+import mmap
+import os
+import pickle
+import re
+import shutil
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from hashlib import blake2b
+from pathlib import Path
+
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def normalize(text):
+    """Accent folded, case folded, alphanumeric tokens separated by single spaces."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+    return NON_ALNUM.sub(" ", folded).strip()
+
+
+def name_hash(normalized):
+    return int.from_bytes(
+        blake2b(normalized.encode(), digest_size=8).digest(), "little"
+    )
+
+
+def trigrams(normalized):
+    grams = set()
+    for token in normalized.split():
+        padded = f"  {token} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class SearchIndexWriter:
+    """
+    Builds a trigram name index for one entity type while the parser streams records.
+    Doc ids index the names table, postings are uint32 doc id arrays per trigram.
+    Doc ids sorted by normalized name hash give exact matches without postings.
+    """
+
+    entity_type = None
+    kinds = {"name": 0, "alias": 1, "name_variation": 2}
+
+    def __init__(self, file_name=None) -> None:
+        self.file_name = file_name
+        self.tmp_dir = Path(f"{file_name}.tmp")
+        self.docs_file = None
+        self.doc_offsets = array("Q", [0])
+        self.doc_entities = array("q")
+        self.doc_kinds = array("B")
+        self.doc_hashes = array("Q")
+        self.postings = {}
+
+    def open_file(self):
+        if not self.docs_file:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            os.makedirs(self.tmp_dir)
+            self.docs_file = open(self.tmp_dir / "docs.bin", "wb")
+
+    def write_rows(self, rows):
+        self.open_file()
+        for row in rows:
+            self.write_record(row)
+        self.close_file()
+
+    def write_record(self, row):
+        if row.get("id") is None:
+            return
+        entity_id = int(row["id"])
+        seen = set()
+        for kind, name in self.get_names(row):
+            if not name:
+                continue
+            normalized = normalize(name)
+            if not normalized or normalized in seen:
+                continue
+            seen.add(normalized)
+            self.add_doc(entity_id, self.kinds[kind], name.strip(), normalized)
+
+    def add_doc(self, entity_id, kind, name, normalized):
+        doc_id = len(self.doc_entities)
+        encoded = name.encode()
+        self.docs_file.write(encoded)
+        self.doc_offsets.append(self.doc_offsets[-1] + len(encoded))
+        self.doc_entities.append(entity_id)
+        self.doc_kinds.append(kind)
+        self.doc_hashes.append(name_hash(normalized))
+        for gram in trigrams(normalized):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array("I")
+            posting.append(doc_id)
+
+    def get_names(self, row):
+        raise NotImplementedError("Subclass must implement get_names()")
+
+    def close_file(self):
+        if not self.docs_file:
+            return
+        self.docs_file.close()
+        self.docs_file = None
+        lexicon = {}
+        with open(self.tmp_dir / "postings.bin", "wb") as f:
+            offset = 0
+            for gram in sorted(self.postings):
+                posting = self.postings[gram]
+                lexicon[gram] = (offset, len(posting))
+                posting.tofile(f)
+                offset += len(posting)
+        with open(self.tmp_dir / "lexicon.pkl", "wb") as f:
+            pickle.dump(lexicon, f, protocol=pickle.HIGHEST_PROTOCOL)
+        for name in ["doc_offsets", "doc_entities", "doc_kinds"]:
+            with open(self.tmp_dir / f"{name}.bin", "wb") as f:
+                getattr(self, name).tofile(f)
+        exact_docs = array(
+            "I", sorted(range(len(self.doc_hashes)), key=self.doc_hashes.__getitem__)
+        )
+        exact_hashes = array("Q", (self.doc_hashes[doc_id] for doc_id in exact_docs))
+        with open(self.tmp_dir / "exact_hashes.bin", "wb") as f:
+            exact_hashes.tofile(f)
+        with open(self.tmp_dir / "exact_docs.bin", "wb") as f:
+            exact_docs.tofile(f)
+        self.postings = {}
+        self.doc_hashes = array("Q")
+        shutil.rmtree(self.file_name, ignore_errors=True)
+        os.rename(self.tmp_dir, self.file_name)
+
+
+class ArtistSearchWriter(SearchIndexWriter):
+    entity_type = "artist"
+
+    def get_names(self, row):
+        return [
+            ("name", row.get("artist")),
+            *[("alias", alias) for alias in row.get("aliases", [])],
+            *[("name_variation", name) for name in row.get("name_variations", [])],
+        ]
+
+
+class LabelSearchWriter(SearchIndexWriter):
+    entity_type = "label"
+
+    def get_names(self, row):
+        return [("name", row.get("label"))]
+
+
+class ReleaseSearchWriter(SearchIndexWriter):
+    entity_type = "release"
+
+    def get_names(self, row):
+        return [("name", row.get("title"))]
+
+
+def setup_search_writers(search_path):
+    os.makedirs(search_path, exist_ok=True)
+    return {
+        "artist_search_writer": ArtistSearchWriter(f"{search_path}/artist_search"),
+        "label_search_writer": LabelSearchWriter(f"{search_path}/label_search"),
+        "release_search_writer": ReleaseSearchWriter(f"{search_path}/release_search"),
+    }
+
+
+class EntityIndex:
+    """Read side of one entity type's index, memory mapped."""
+
+    kind_bonus = {0: 0.1, 1: 0.05, 2: 0.0}
+
+    def __init__(self, directory) -> None:
+        self.directory = Path(directory)
+        with open(self.directory / "lexicon.pkl", "rb") as f:
+            self.lexicon = pickle.load(f)
+        self.postings = self.map_array("postings.bin", "I")
+        self.docs = self.map_array("docs.bin", "B")
+        self.doc_offsets = self.map_array("doc_offsets.bin", "Q")
+        self.doc_entities = self.map_array("doc_entities.bin", "q")
+        self.doc_kinds = self.map_array("doc_kinds.bin", "B")
+        self.exact_hashes = self.map_array("exact_hashes.bin", "Q")
+        self.exact_docs = self.map_array("exact_docs.bin", "I")
+
+    def map_array(self, file_name, typecode):
+        with open(self.directory / file_name, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return memoryview(b"").cast(typecode)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(mapped).cast(typecode)
+
+    def doc_name(self, doc_id):
+        start, end = self.doc_offsets[doc_id], self.doc_offsets[doc_id + 1]
+        return bytes(self.docs[start:end]).decode()
+
+    def exact_matches(self, normalized):
+        query_hash = name_hash(normalized)
+        start = bisect_left(self.exact_hashes, query_hash)
+        end = bisect_right(self.exact_hashes, query_hash, start)
+        return list(self.exact_docs[start:end])
+
+    def candidates(
+        self, normalized, query_grams, min_overlap, max_candidates, max_postings
+    ):
+        found = sorted(
+            (self.lexicon[gram] for gram in query_grams if gram in self.lexicon),
+            key=lambda entry: entry[1],
+        )
+        # A doc sharing min_overlap of the query trigrams must appear in at least
+        # one of the rarest len - min_overlap + 1 postings, so the rest are skipped.
+        # Very common trigrams are also dropped once max_postings ids were counted,
+        # which keeps latency bounded for short or generic queries.
+        hits = Counter()
+        counted = 0
+        for offset, length in found[: max(len(query_grams) - min_overlap + 1, 1)]:
+            if counted and counted + length > max_postings:
+                break
+            hits.update(self.postings[offset : offset + length])
+            counted += length
+        # Exact names come first, ties among thousands of names containing the
+        # query (e.g. "John Smith 2") could otherwise push them out of the top.
+        exact = self.exact_matches(normalized)
+        ranked = (doc_id for doc_id, _ in hits.most_common(max_candidates))
+        exact_set = set(exact)
+        return exact + [doc_id for doc_id in ranked if doc_id not in exact_set]
+
+    def search(
+        self,
+        query,
+        limit=10,
+        min_similarity=0.3,
+        max_candidates=500,
+        max_postings=250_000,
+    ):
+        normalized = normalize(query)
+        query_grams = trigrams(normalized)
+        if not query_grams:
+            return []
+        min_overlap = max(int(len(query_grams) * min_similarity), 1)
+        query_tokens = set(normalized.split())
+        best = {}
+        candidates = self.candidates(
+            normalized, query_grams, min_overlap, max_candidates, max_postings
+        )
+        for doc_id in candidates:
+            name = self.doc_name(doc_id)
+            doc_normalized = normalize(name)
+            doc_grams = trigrams(doc_normalized)
+            similarity = len(query_grams & doc_grams) / len(query_grams | doc_grams)
+            if similarity < min_similarity:
+                continue
+            score = similarity + self.kind_bonus[self.doc_kinds[doc_id]]
+            if doc_normalized == normalized:
+                score += 0.5
+            elif query_tokens <= set(doc_normalized.split()):
+                score += 0.2
+            entity_id = self.doc_entities[doc_id]
+            if entity_id not in best or score > best[entity_id][0]:
+                best[entity_id] = (score, name)
+        ranked = sorted(best.items(), key=lambda item: item[1][0], reverse=True)
+        return [
+            {"id": entity_id, "name": name, "score": round(score, 4)}
+            for entity_id, (score, name) in ranked[:limit]
+        ]
+
+
+class NameSearch:
+    """Ranked fuzzy name lookups across the artist, label and release indexes."""
+
+    def __init__(self, search_path) -> None:
+        self.indexes = {
+            entity_dir.name.removesuffix("_search"): EntityIndex(entity_dir)
+            for entity_dir in sorted(Path(search_path).iterdir())
+            if (entity_dir / "lexicon.pkl").exists()
+        }
+
+    def search(self, query, entity_types=None, limit=10):
+        results = []
+        for entity_type, index in self.indexes.items():
+            if entity_types and entity_type not in entity_types:
+                continue
+            for match in index.search(query, limit=limit):
+                results.append({"entity_type": entity_type, **match})
+        results.sort(key=lambda match: match["score"], reverse=True)
+        return results[:limit]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Discogs name search")
+    parser.add_argument("--index", help="Search index directory", required=True)
+    parser.add_argument("--query", required=True)
+    parser.add_argument(
+        "--type", nargs="+", choices=["artist", "label", "release"], required=False
+    )
+    parser.add_argument("--limit", type=int, default=10)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    search = NameSearch(args.index)
+    start_time = time.perf_counter()
+    results = search.search(args.query, entity_types=args.type, limit=args.limit)
+    duration = (time.perf_counter() - start_time) * 1000
+    for match in results:
+        print(
+            f"{match['score']:.3f}  {match['entity_type']:<8} {match['id']:<10} {match['name']}"
+        )
+    print(f"{len(results)} matches in {duration:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import base64
+import json
+import math
+import os
+from collections import Counter
+from hashlib import blake2b
+from pathlib import Path
+
+MASK_64 = (1 << 64) - 1
+# Long unique text, heavy hitters of these are neither cheap nor useful.
+free_text_columns = {
+    "title",
+    "notes",
+    "profile",
+    "url",
+    "contact_info",
+    "description",
+    "real_name",
+}
+
+
+def stable_hash(value):
+    # Builtin hash() is salted per process, sketches must merge across runs.
+    if isinstance(value, int) or (
+        isinstance(value, str) and value.isascii() and value.isdigit()
+    ):
+        # Ids are most of the values, the murmur3 finalizer mixes them far
+        # cheaper than a blake2b digest.
+        hashed = int(value) & MASK_64
+        hashed = (hashed ^ (hashed >> 33)) * 0xFF51AFD7ED558CCD & MASK_64
+        hashed = (hashed ^ (hashed >> 33)) * 0xC4CEB9FE1A85EC53 & MASK_64
+        return hashed ^ (hashed >> 33)
+    return int.from_bytes(blake2b(str(value).encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    def __init__(self, precision=14, registers=None) -> None:
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.m)
+        self.rank_bits = 64 - precision
+        self.rank_mask = (1 << self.rank_bits) - 1
+
+    def add(self, value):
+        hashed = stable_hash(value)
+        index = hashed >> self.rank_bits
+        rank = self.rank_bits - (hashed & self.rank_mask).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        merged = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return HyperLogLog(self.precision, merged)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            return round(self.m * math.log(self.m / zeros))
+        return round(raw)
+
+    def to_json(self):
+        return base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def from_json(cls, data, precision=14):
+        return cls(precision, bytearray(base64.b64decode(data)))
+
+
+class HeavyHitters:
+    """
+    Batched Misra-Gries: counts are reduced once the table holds 2 * capacity
+    values, so updates stay O(1) amortized. Reported counts are lower bounds,
+    off by at most `error`.
+    """
+
+    def __init__(self, capacity=50) -> None:
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, value, count=1):
+        self.counts[value] = self.counts.get(value, 0) + count
+        if len(self.counts) > 2 * self.capacity:
+            decrement = sorted(self.counts.values(), reverse=True)[self.capacity]
+            self.error += decrement
+            self.counts = {
+                v: count - decrement
+                for v, count in self.counts.items()
+                if count > decrement
+            }
+
+    def top(self, n=20):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class ColumnStats:
+    def __init__(self, name) -> None:
+        self.name = name
+        self.is_id = name == "id" or name.endswith("_id")
+        # A table's own id is unique, so it has no heavy hitters to track.
+        self.track_top = name != "id" and name not in free_text_columns
+        self.count = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = HyperLogLog()
+        self.heavy_hitters = HeavyHitters()
+
+    def update(self, values):
+        self.count += len(values)
+        # Each distinct value of the batch is hashed and measured once.
+        for value, count in Counter(values).items():
+            if value is None or value == "":
+                self.nulls += count
+                continue
+            self.distinct.add(value)
+            if self.track_top:
+                self.heavy_hitters.add(value, count)
+            # Ids get numeric min/max, everything else min/max length.
+            if self.is_id:
+                if not str(value).isdigit():
+                    continue
+                measure = int(value)
+            else:
+                measure = len(str(value))
+            if self.minimum is None or measure < self.minimum:
+                self.minimum = measure
+            if self.maximum is None or measure > self.maximum:
+                self.maximum = measure
+
+    def to_json(self):
+        bounds = ("min", "max") if self.is_id else ("min_length", "max_length")
+        return {
+            "count": self.count,
+            "nulls": self.nulls,
+            "null_rate": self.nulls / self.count if self.count else 0,
+            "distinct_estimate": self.distinct.estimate(),
+            bounds[0]: self.minimum,
+            bounds[1]: self.maximum,
+            "top": [[str(value), count] for value, count in self.heavy_hitters.top()],
+            "top_error": self.heavy_hitters.error,
+            "hll": self.distinct.to_json(),
+        }
+
+
+class TableStats:
+    def __init__(self, table, headers) -> None:
+        self.table = table
+        self.rows = 0
+        self.columns = {header: ColumnStats(header) for header in headers}
+
+    def update(self, rows):
+        self.rows += len(rows)
+        for name, column in self.columns.items():
+            column.update([row.get(name) for row in rows])
+
+    def write(self, stats_path):
+        os.makedirs(stats_path, exist_ok=True)
+        data = {
+            "table": self.table,
+            "rows": self.rows,
+            "columns": {
+                name: column.to_json() for name, column in self.columns.items()
+            },
+        }
+        with open(f"{stats_path}/{self.table}.json", "w") as f:
+            json.dump(data, f, indent=2)
+
+
+def load_stats(stats_path):
+    tables = {}
+    for file_path in sorted(Path(stats_path).glob("*.json")):
+        with open(file_path) as f:
+            data = json.load(f)
+        tables[data["table"]] = data
+    return tables
+
+
+def relative_change(old, new):
+    if not old:
+        return math.inf if new else 0.0
+    return (new - old) / old
+
+
+def compare_stats(old_path, new_path, threshold=0.1):
+    """Lists drift between two ingests using only their stats files."""
+    old_tables, new_tables = load_stats(old_path), load_stats(new_path)
+    report = []
+    for table in sorted(set(old_tables) | set(new_tables)):
+        if table not in old_tables or table not in new_tables:
+            report.append(f"{table}: only in {'new' if table in new_tables else 'old'}")
+            continue
+        old, new = old_tables[table], new_tables[table]
+        change = relative_change(old["rows"], new["rows"])
+        flag = " DRIFT" if abs(change) > threshold else ""
+        report.append(
+            f"{table}: rows {old['rows']} -> {new['rows']} ({change:+.1%}){flag}"
+        )
+        for name, new_column in new["columns"].items():
+            old_column = old["columns"].get(name)
+            if old_column is None:
+                report.append(f"  {name}: new column")
+                continue
+            null_delta = new_column["null_rate"] - old_column["null_rate"]
+            if abs(null_delta) > threshold / 10:
+                report.append(
+                    f"  {name}: null rate {old_column['null_rate']:.2%} -> "
+                    f"{new_column['null_rate']:.2%}"
+                )
+            distinct_change = relative_change(
+                old_column["distinct_estimate"], new_column["distinct_estimate"]
+            )
+            if abs(distinct_change) > threshold:
+                report.append(
+                    f"  {name}: distinct {old_column['distinct_estimate']} -> "
+                    f"{new_column['distinct_estimate']} ({distinct_change:+.1%})"
+                )
+            old_hll = HyperLogLog.from_json(old_column["hll"])
+            new_hll = HyperLogLog.from_json(new_column["hll"])
+            unseen = old_hll.merge(new_hll).estimate() - old_hll.estimate()
+            if (
+                new_column["distinct_estimate"]
+                and unseen / new_column["distinct_estimate"] > threshold
+            ):
+                report.append(f"  {name}: ~{unseen} values not seen in the old ingest")
+            old_top = {value for value, _ in old_column["top"][:10]}
+            entered = [
+                value
+                for value, count in new_column["top"][:10]
+                if value not in old_top and count > 1
+            ]
+            if entered:
+                report.append(f"  {name}: new in top 10: {', '.join(entered)}")
+    return report
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Compare ingest statistics")
+    parser.add_argument(
+        "--old", help="Stats directory of the previous ingest", required=True
+    )
+    parser.add_argument(
+        "--new", help="Stats directory of the current ingest", required=True
+    )
+    parser.add_argument("--threshold", type=float, default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    for line in compare_stats(args.old, args.new, args.threshold):
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
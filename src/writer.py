@@ -1,4 +1,6 @@
 import csv
+from pathlib import Path
+from stats import TableStats
 
 
 class BaseWriter:
@@ -9,6 +11,12 @@ class BaseWriter:
         self.writer = None
         self.batch_size = 15_000
         self.buffer = []
+        self.stats = None
+        self.stats_path = None
+
+    def enable_stats(self, stats_path):
+        self.stats = TableStats(Path(self.file_name).stem, self.headers)
+        self.stats_path = stats_path
 
     def open_file(self):
         if not self.file:
@@ -23,6 +31,8 @@ class BaseWriter:
 
     def flush_buffer(self):
         if self.buffer:
+            if self.stats is not None:
+                self.stats.update(self.buffer)
             self.writer.writerows(self.buffer)
             self.buffer.clear()
 
@@ -32,25 +42,33 @@ class BaseWriter:
         if self.file:
             self.file.close()
             self.file = None
+            if self.stats is not None:
+                self.stats.write(self.stats_path)
 
 
 class SimpleWriter(BaseWriter):
     def write_rows(self, rows):
         self.open_file()
         for row in rows:
-            data = {k: row[k] for k in self.headers if k in row}
-            self.write_row(data)
+            self.write_record(row)
         self.close_file()
 
+    def write_record(self, row):
+        data = {k: row[k] for k in self.headers if k in row}
+        self.write_row(data)
+
 
 class NestedWriter(BaseWriter):
     def write_rows(self, rows):
         self.open_file()
         for row in rows:
-            for sub_item in self.get_sub_items(row):
-                self.write_row(sub_item)
+            self.write_record(row)
         self.close_file()
 
+    def write_record(self, row):
+        for sub_item in self.get_sub_items(row):
+            self.write_row(sub_item)
+
     def get_sub_items(self, row):
         raise NotImplementedError("Subclass must implement get_sub_items()")
 
@@ -101,12 +119,13 @@ class ArtistAliasWriter(NestedWriter):
         self.headers = [
             "artist_id",
             "alias",
+            "alias_id",
         ]
 
     def get_sub_items(self, row):
         return [
-            {"artist_id": row.get("id"), "alias": alias.strip()}
-            for alias in row.get("aliases", [])
+            {"artist_id": row.get("id"), "alias": alias.strip(), "alias_id": alias_id}
+            for alias, alias_id in zip(row.get("aliases", []), row.get("alias_ids", []))
         ]
 
 
@@ -178,6 +197,16 @@ class ReleaseTracksWriter(NestedWriter):
             "duration_seconds",
         ]
 
+    @staticmethod
+    def duration_seconds(duration):
+        parts = (duration or "").split(":")
+        if not all(part.isdigit() for part in parts):
+            return None
+        seconds = 0
+        for part in parts:
+            seconds = seconds * 60 + int(part)
+        return seconds
+
     def get_sub_items(self, row):
         return [
             {
@@ -185,13 +214,12 @@ class ReleaseTracksWriter(NestedWriter):
                 "title": trck_title,
                 "duration": trck_duration,
                 "position": trck_position,
-                "duration_seconds": duration_secs,
+                "duration_seconds": self.duration_seconds(trck_duration),
             }
-            for trck_title, trck_duration, trck_position, duration_secs in zip(
+            for trck_title, trck_duration, trck_position in zip(
                 row.get("track_title", []),
                 row.get("track_duration", []),
                 row.get("track_position", []),
-                row.get("duration", []),
             )
         ]
 
@@ -306,12 +334,12 @@ class MasterVideoWriter(NestedWriter):
 class MasterGenreWriter(NestedWriter):
     def __init__(self, file_name=None) -> None:
         super().__init__(file_name)
-        self.headers = ["master_id", "style"]
+        self.headers = ["master_id", "genre"]
 
     def get_sub_items(self, row):
         return [
-            {"master_id": row.get("id"), "style": style.strip()}
-            for style in row.get("genre")
+            {"master_id": row.get("id"), "genre": genre.strip()}
+            for genre in row.get("genre")
         ]
 
 
@@ -1,7 +1,38 @@
 from writer import *
+from parser import ArtistParser, LabelParser, MasterParser, ReleaseParser
 
+files_and_parsers = {
+    "label": ("discogs_20240701_labels.xml.gz", LabelParser),
+    "artist": ("discogs_20240701_artists.xml.gz", ArtistParser),
+    "release": ("discogs_20240701_releases.xml.gz", ReleaseParser),
+    "master": ("discogs_20240701_masters.xml.gz", MasterParser),
+}
 
-def setup_writers(csv_path=None):
+writer_tables = {
+    "artist_writer": "artist",
+    "artist_alias_writer": "artist_alias",
+    "artist_url_writer": "artist_url",
+    "artist_name_var_writer": "artist_name_variation",
+    "label_writer": "label",
+    "label_url_writer": "label_url",
+    "label_sub_writer": "sub_label",
+    "release_writer": "release",
+    "release_tracks_writer": "release_track",
+    "release_artist_writer": "release_artist",
+    "release_extra_artist_writer": "release_extra_artist",
+    "release_style_writer": "release_style",
+    "release_genre_writer": "release_genre",
+    "release_company_writer": "release_company",
+    "release_video_writer": "release_video",
+    "master_writer": "master",
+    "master_video_writer": "master_video",
+    "master_styles_writer": "master_style",
+    "master_genre_writer": "master_genre",
+    "master_artist_writer": "master_artist",
+}
+
+
+def setup_writers(csv_path=None, tables=None):
     writers = {
         "artist_writer": ArtistWriter(file_name=f"{csv_path}/artist.csv"),
         "artist_alias_writer": ArtistAliasWriter(
@@ -51,11 +82,17 @@ def setup_writers(csv_path=None):
         "master_styles_writer": MasterStylesWriter(
             file_name=f"{csv_path}/master_style.csv"
         ),
-        "master_genre_writer": MasterStylesWriter(
+        "master_genre_writer": MasterGenreWriter(
             file_name=f"{csv_path}/master_genre.csv"
         ),
         "master_artist_writer": MasterArtistWriter(
             file_name=f"{csv_path}/master_artist.csv",
         ),
     }
+    if tables is not None:
+        writers = {
+            name: writer
+            for name, writer in writers.items()
+            if writer_tables[name] in tables
+        }
     return writers